@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import geopandas as gpd
+from shapely.geometry import mapping
+from yeoda.products.base import ProductDataCube
+
+from instrumentation import stage
+from testarea import TestArea
+from register_index import DEFAULT_CACHE_DIR
+from timeseries_by_geom import DataCubeLoader, TimeSeriesByGeom
+from timeseries_store import TimeSeriesStore
+from zonal_stats import zonal_statistics
+
+GRID_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'Austria_shapefile')
+GRIDS = {'1km': 'at_1km.shp', '10km': 'at_10km.shp', '100km': 'at_100km.shp'}
+
+
+def load_grid_cells(grid: str = '10km',
+                    grid_dir: str = GRID_DIR,
+                    id_column: str = 'CELLCODE') -> List[TestArea]:
+    '''Returns the cells of one of the Austria reference grids as TestAreas (EPSG:4326)
+
+    Parameters
+    ----------
+
+    grid: str
+        '1km', '10km' or '100km'. Default: '10km'
+    grid_dir: str
+        Folder of the grid shapefiles. Default: `Austria_shapefile` of this repository
+    id_column: str
+        Attribute holding the cell codes. Default: 'CELLCODE'
+
+    Returns
+    -------
+
+    List[TestArea]
+    '''
+    if grid not in GRIDS:
+        raise ValueError(f'grid must be one of {list(GRIDS)}, not {grid}')
+    grid_path = os.path.join(grid_dir, GRIDS[grid])
+    if not os.path.isfile(grid_path):
+        raise FileNotFoundError(
+            f'The specified shapefile {grid_path} does not exist.')
+
+    cells = gpd.read_file(grid_path).to_crs("EPSG:4326")
+    return [
+        TestArea(name=str(cell_code),
+                 forest_type='grid_cell',
+                 _geom=mapping(geometry),
+                 info=f'{grid} grid cell')
+        for cell_code, geometry in zip(cells[id_column], cells.geometry)
+    ]
+
+
+class Checkpoint:
+    '''Append-only JSON lines log of the finished cells of a batch run
+
+    Parameters
+    ----------
+
+    path: str
+        Path of the log file, created if it does not exist
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.finished = set()
+        self._lock = threading.Lock()
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:  # last line of a crashed run
+                        continue
+                    if record['status'] == 'done':
+                        self.finished.add(record['cell'])
+
+    def is_done(self, cell: str) -> bool:
+        return cell in self.finished
+
+    def mark(self, cell: str, status: str, info: Optional[str] = None) -> None:
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(
+                    json.dumps({
+                        'cell': cell,
+                        'status': status,
+                        'info': info
+                    }) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            if status == 'done':
+                self.finished.add(cell)
+
+
+class GridBatchRunner:
+    '''Runs time-series extraction or zonal statistics for every cell of a reference grid
+
+    Finished cells are recorded in a checkpoint file in `output_dir`, so a crashed run
+    resumes with the remaining cells. The cells are processed in a thread pool that
+    shares the loader and its cached datacube.
+
+    Parameters
+    ----------
+
+    loaded_datacube: DataCubeLoader
+        Loader shared by all cells
+    grid: str
+        '1km', '10km' or '100km'. Default: '10km'
+    mode: str
+        'zonal' (per-date statistics as CSV per cell) or 'timeseries' (appended to a
+        TimeSeriesStore). Default: 'zonal'
+    output_dir: Optional[str]
+        Folder of the results and the checkpoint. Default: `DEFAULT_CACHE_DIR/grid_<grid>`
+    datacube: Optional[ProductDataCube]
+        The (filtered) datacube, e.g. one polarisation and time range.
+        Default: None (`loaded_datacube.datacube`)
+    n_workers: int
+        Number of cells processed in parallel. Default: 1
+    grid_dir: str
+        Folder of the grid shapefiles. Default: `GRID_DIR`
+    '''
+
+    def __init__(self,
+                 loaded_datacube: DataCubeLoader,
+                 grid: str = '10km',
+                 mode: str = 'zonal',
+                 output_dir: Optional[str] = None,
+                 datacube: Optional[ProductDataCube] = None,
+                 n_workers: int = 1,
+                 grid_dir: str = GRID_DIR) -> None:
+        if mode not in ('zonal', 'timeseries'):
+            raise ValueError(
+                f"mode must be 'zonal' or 'timeseries', not '{mode}'")
+
+        self.loader = loaded_datacube
+        self.grid = grid
+        self.mode = mode
+        self.datacube = datacube
+        self.n_workers = n_workers
+        self.cells = load_grid_cells(grid, grid_dir)
+
+        self.output_dir = output_dir or os.path.join(DEFAULT_CACHE_DIR,
+                                                     f'grid_{grid}')
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.checkpoint = Checkpoint(
+            os.path.join(self.output_dir, f'checkpoint_{mode}.jsonl'))
+        self.store = None
+        if mode == 'timeseries':
+            self.store = TimeSeriesStore(
+                os.path.join(self.output_dir, 'timeseries'))
+
+    def _process_cell(self, cell: TestArea) -> None:
+        datacube = self.datacube
+        if datacube is None:
+            datacube = self.loader.datacube
+        with warnings.catch_warnings(), stage('geometry_filter'):
+            warnings.simplefilter("ignore")
+            datacube = datacube.filter_spatially_by_geom(cell.bbox,
+                                                         sref=self.loader.sref)
+        if len(datacube) == 0:
+            return
+
+        timeseries = TimeSeriesByGeom(cell, self.loader)
+        if self.mode == 'zonal':
+            path = os.path.join(self.output_dir, f'{cell.name}.csv')
+            zonal_statistics(timeseries,
+                             datacube=datacube).to_csv(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        else:
+            timeseries.update_store(self.store,
+                                    datacube=datacube,
+                                    apply_mask=True)
+
+    def run(self, cell_names: Optional[List[str]] = None) -> Dict[str, str]:
+        '''Processes all (or the given) cells that are not finished yet
+
+        Returns
+        -------
+
+        Dict[str, str]
+            'done' or the error message per processed cell
+        '''
+        todo = [
+            cell for cell in self.cells
+            if (cell_names is None or cell.name in cell_names)
+            and not self.checkpoint.is_done(cell.name)
+        ]
+        print(f'{len(self.cells) - len(todo)} cells already finished, '
+              f'{len(todo)} to go...')
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            futures = {
+                pool.submit(self._process_cell, cell): cell.name
+                for cell in todo
+            }
+            for future in as_completed(futures):
+                cell_name = futures[future]
+                try:
+                    future.result()
+                    self.checkpoint.mark(cell_name, 'done')
+                    results[cell_name] = 'done'
+                except Exception as e:
+                    self.checkpoint.mark(cell_name, 'failed', repr(e))
+                    results[cell_name] = repr(e)
+        return dict(sorted(results.items()))
@@ -0,0 +1,186 @@
+import json
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+# shared no-op context manager, returned by `Profiler.stage` while disabled
+_DISABLED_STAGE = nullcontext()
+COUNTERS = ('files', 'bytes_read', 'pixels')
+
+
+class _Stage:
+    '''One timed stage, created by `Profiler.stage`'''
+
+    __slots__ = ('profiler', 'name', 'tags', 'counts', 'parent', '_start')
+
+    def __init__(self, profiler: 'Profiler', name: str, tags: dict) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.tags = tags
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.parent = None
+
+    def __enter__(self) -> '_Stage':
+        stack = self.profiler._stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        seconds = perf_counter() - self._start
+        self.profiler._stack().pop()
+        self.profiler._record({
+            'stage': self.name,
+            'parent': self.parent,
+            'thread': threading.get_ident(),
+            'seconds': seconds,
+            **self.counts,
+            'failed': exc_info[0] is not None,
+            **self.tags
+        })
+
+
+class Profiler:
+    '''Collects wall time, files opened, bytes read and pixels produced per stage
+
+    Disabled by default: `stage` then returns a shared no-op context manager and `count`
+    returns right away, so the instrumented code paths cost one attribute lookup.
+    Stages nest per thread, counters are added to the innermost open stage. Stages of
+    worker processes (`masked_array(..., executor='process')`) are not collected.
+
+    Example
+    -------
+
+    >>> PROFILER.enable()
+    >>> masked = timeseries.masked_array(datacube, apply_mask=True)
+    >>> PROFILER.summary()
+    >>> PROFILER.to_csv('profile.csv')
+    '''
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._records: List[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._records = []
+
+    def _stack(self) -> List[_Stage]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, record: dict) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def stage(self, name: str, **tags):
+        '''Context manager timing the enclosed code as stage `name`
+
+        Parameters
+        ----------
+
+        name: str
+            Stage name, e.g. 'geotiff_read'
+        **tags
+            Extra columns of the record, e.g. the test area name
+        '''
+        if not self.enabled:
+            return _DISABLED_STAGE
+        return _Stage(self, name, tags)
+
+    def count(self,
+              files: int = 0,
+              bytes_read: int = 0,
+              pixels: int = 0) -> None:
+        '''Adds to the counters of the innermost open stage of this thread'''
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if stack:
+            counts = stack[-1].counts
+            counts['files'] += files
+            counts['bytes_read'] += bytes_read
+            counts['pixels'] += pixels
+
+    @property
+    def records(self) -> List[dict]:
+        '''One dict per finished stage, in the order they finished'''
+        with self._lock:
+            return list(self._records)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        records = self.records
+        if not records:
+            return pd.DataFrame(
+                columns=['stage', 'parent', 'thread', 'seconds', *COUNTERS])
+        return pd.DataFrame(records)
+
+    def summary(self) -> pd.DataFrame:
+        '''Calls, total/mean wall time and counters per stage'''
+        frame = self.to_dataframe()
+        summary = frame.groupby('stage').agg(calls=('seconds', 'size'),
+                                             seconds=('seconds', 'sum'),
+                                             mean_seconds=('seconds', 'mean'),
+                                             **{
+                                                 counter: (counter, 'sum')
+                                                 for counter in COUNTERS
+                                             })
+        return summary.sort_values('seconds', ascending=False)
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        report = json.dumps(
+            {
+                'records': self.records,
+                'summary': json.loads(
+                    self.summary().reset_index().to_json(orient='records'))
+            },
+            indent=2,
+            default=str)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+        return report
+
+    def to_csv(self, path: str) -> None:
+        self.to_dataframe().to_csv(path, index=False)
+
+
+# process wide profiler used by the instrumented modules
+PROFILER = Profiler()
+
+
+def stage(name: str, **tags):
+    '''`PROFILER.stage`'''
+    return PROFILER.stage(name, **tags)
+
+
+def count(files: int = 0, bytes_read: int = 0, pixels: int = 0) -> None:
+    '''`PROFILER.count`'''
+    PROFILER.count(files, bytes_read, pixels)
+
+
+def enable() -> None:
+    PROFILER.enable()
+
+
+def disable() -> None:
+    PROFILER.disable()
+
+
+def report() -> Dict[str, pd.DataFrame]:
+    '''{'records': all stages, 'summary': per stage} of `PROFILER`'''
+    return {'records': PROFILER.to_dataframe(), 'summary': PROFILER.summary()}
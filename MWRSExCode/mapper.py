@@ -2,31 +2,57 @@ import plotly.express as px
 import plotly.graph_objects as go
 from dataclasses import dataclass
 import os
-from typing import List
+from typing import List, Union
+import numpy as np
 import pandas as pd
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Polygon, Point, mapping
 from typing import Optional
 
 from testarea import TestArea, coords_from_google_maps
 
 
+# MapOverview switches to the bulk rendering above this number of test areas
+BULK_THRESHOLD = 200
+
+
 @dataclass
 class MapboxMap:
     token: str
     style_url: str
 
 
+def tolerance_for_zoom(zoom: float, pixels: float = 1.0) -> float:
+    '''Simplification tolerance [degrees] of `pixels` web map pixels at `zoom`
+
+    The zoom is rounded down to an integer level, so the tolerances (and the cached
+    geometries) are shared between close zoom levels.
+    '''
+    return pixels * 360 / (256 * 2**int(zoom))
+
+
+def _nan_separated(coords: List[np.ndarray]) -> np.ndarray:
+    '''Stacks (n, 2) coordinate arrays into one array with NaN rows between the parts'''
+    separator = np.full((1, 2), np.nan)
+    return np.concatenate([part for c in coords for part in (c, separator)])
+
+
 class Map:
+    '''Map of a single test area
+
+    The polygon is drawn simplified to the resolution of the zoom level, the
+    simplified geometries and their GeoJSON are cached per zoom level.
+    '''
 
     def __init__(self,
                  testarea: TestArea,
                  zoom=10,
                  custom_map: MapboxMap = None):
         self.testarea = testarea
-        self.lon, self.lat = testarea.mask.exterior.coords.xy
-        self.lon, self.lat = list(self.lon), list(self.lat)
-        self.coord_pairs = [[lon, lat] for lon, lat in zip(self.lon, self.lat)]
         self.zoom = zoom
+        min_lon, min_lat, max_lon, max_lat = testarea.bounds
+        self._center = [(max_lon + min_lon) / 2, (max_lat + min_lat) / 2]
+        self._dimensions = [max_lon - min_lon, max_lat - min_lat]
+        self._geojson = {}
 
         if custom_map:
             self.token = custom_map.token
@@ -35,29 +61,44 @@ class Map:
             self.token = None
             self.style_url = 'open-street-map'
 
+    @property
+    def lon(self) -> np.ndarray:
+        return self.testarea.coords[:, 0]
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self.testarea.coords[:, 1]
+
+    @property
+    def coord_pairs(self) -> list:
+        return self.testarea.coords.tolist()
+
     @property
     def center(self):
-        return [(max(self.lon) + min(self.lon)) / 2,
-                (max(self.lat) + min(self.lat)) / 2]
-
-    def get_polygon_geojson(self):
-        return {
-            "type": "Feature",
-            "geometry": {
-                "type": "Polygon",
-                "coordinates":
-                [self.coord_pairs]  # Wrap coordinates in an extra list
-            },
-            "properties": {}
-        }
+        return self._center
+
+    def coords(self, zoom: Optional[float] = None) -> np.ndarray:
+        '''(n, 2) exterior coordinates simplified for `zoom`. Default: `self.zoom`'''
+        zoom = self.zoom if zoom is None else zoom
+        return np.asarray(
+            self.testarea.simplified(tolerance_for_zoom(zoom)).exterior.coords)
+
+    def get_polygon_geojson(self, zoom: Optional[float] = None):
+        zoom = self.zoom if zoom is None else zoom
+        tolerance = tolerance_for_zoom(zoom)
+        if tolerance not in self._geojson:
+            self._geojson[tolerance] = {
+                "type": "Feature",
+                "geometry": mapping(self.testarea.simplified(tolerance)),
+                "properties": {}
+            }
+        return self._geojson[tolerance]
 
     def get_polygon_dimensions(self):
-        return [(max(self.lon) - min(self.lon)),
-                (max(self.lat) - min(self.lat))]
+        return self._dimensions
 
     def get_text_anchor(self):
-        return self.center[
-            0], self.center[1] + 0.6 * self.get_polygon_dimensions()[1]
+        return self._center[0], self._center[1] + 0.6 * self._dimensions[1]
 
     def get_map(self, save=False, format='html'):
 
@@ -71,11 +112,11 @@ class Map:
             polygon_color = "rgba(255, 255, 255, 1)"
 
         polygon_geojson = self.get_polygon_geojson()
-        print(polygon_geojson)
+        coords = self.coords()
 
         fig = px.scatter_mapbox(
-            lat=[y for y in self.lat[:-1]],
-            lon=[x for x in self.lon[:-1]],
+            lat=coords[:-1, 1],
+            lon=coords[:-1, 0],
             zoom=self.zoom,
         )
 
@@ -94,11 +135,12 @@ class Map:
                         center=dict(lat=self.center[1], lon=self.center[0])),
         )
 
+        text_anchor = self.get_text_anchor()
         fig.add_trace(
             go.Scattermapbox(
                 mode="text",
-                lat=[self.get_text_anchor()[1]],
-                lon=[self.get_text_anchor()[0]],
+                lat=[text_anchor[1]],
+                lon=[text_anchor[0]],
                 text=[self.testarea.name],
                 textfont=dict(size=15, color=textcolor),
                 showlegend=False,
@@ -114,14 +156,29 @@ class Map:
 
 
 class MapOverview:
+    '''Overview map of many test areas
+
+    Parameters
+    ----------
+
+    maps: List[Union[Map, TestArea]]
+        The test areas, either wrapped in a `Map` or directly
+    zoom: int
+        Initial zoom level
+    custom_map: MapboxMap
+        Mapbox style and token. Default: None (OpenStreetMap)
+    '''
 
     def __init__(self,
-                 maps: List[Map],
+                 maps: List[Union[Map, TestArea]],
                  zoom: int,
                  custom_map: MapboxMap = None):
         self.maps = maps
-        print(self.maps)
+        self.testareas = [
+            map.testarea if isinstance(map, Map) else map for map in maps
+        ]
         self.zoom = zoom
+        self._bounds = None
 
         if custom_map:
             self.token = custom_map.token
@@ -130,42 +187,71 @@ class MapOverview:
             self.token = None
             self.style_url = 'open-street-map'
 
+    @property
+    def bounds(self) -> np.ndarray:
+        '''(n, 4) array of (min_lon, min_lat, max_lon, max_lat), computed once'''
+        if self._bounds is None:
+            self._bounds = np.array(
+                [testarea.bounds for testarea in self.testareas],
+                dtype=float).reshape(-1, 4)
+        return self._bounds
+
+    @property
+    def centers(self) -> np.ndarray:
+        '''(n, 2) array of the bounding box centres (lon, lat)'''
+        return (self.bounds[:, :2] + self.bounds[:, 2:]) / 2
+
     def get_df(self):
         maps_dict = {
-            'name': [map.testarea.name for map in self.maps],
-            'forest_type': [map.testarea.forest_type for map in self.maps],
-            'lat': [map.lat for map in self.maps],
-            'lon': [map.lon for map in self.maps],
-            'info': [map.testarea.info for map in self.maps]
+            'name': [testarea.name for testarea in self.testareas],
+            'forest_type':
+            [testarea.forest_type for testarea in self.testareas],
+            'lat': [testarea.coords[:, 1] for testarea in self.testareas],
+            'lon': [testarea.coords[:, 0] for testarea in self.testareas],
+            'info': [testarea.info for testarea in self.testareas]
         }
 
         return pd.DataFrame(
             maps_dict, columns=['name', 'forest_type', 'lat', 'lon', 'info'])
 
+    def _coords(self, testarea: TestArea) -> np.ndarray:
+        # exterior coordinates simplified to the resolution of the zoom level
+        return np.asarray(
+            testarea.simplified(tolerance_for_zoom(
+                self.zoom)).exterior.coords)
+
     def get_polygons(self):
-        return [{
-            'name': map.testarea.name,
-            'forest_type': map.testarea.forest_type,
-            'info': map.testarea.info,
-            'testarea_lon': map.lon,
-            'testarea_lat': map.lat,
-            'center': map.center
-        } for map in self.maps]
+        polygons = []
+        for testarea, center in zip(self.testareas, self.centers):
+            coords = self._coords(testarea)
+            polygons.append({
+                'name': testarea.name,
+                'forest_type': testarea.forest_type,
+                'info': testarea.info,
+                'testarea_lon': coords[:, 0],
+                'testarea_lat': coords[:, 1],
+                'center': list(center)
+            })
+        return polygons
 
     def get_super_center(self):
+        return list(self.centers.mean(axis=0))
+
+    def _hover_texts(self) -> List[str]:
         return [
-            sum([map.center[0] for map in self.maps]) / len(self.maps),
-            sum([map.center[1] for map in self.maps]) / len(self.maps)
+            f"{testarea.name}<br>Forest type: {testarea.forest_type}<br>Info: {testarea.info}<br>"
+            for testarea in self.testareas
         ]
 
-    def get_map(self, save=False, format='html'):
-        custom_style_url = self.style_url
-        if self.token:
-            px.set_mapbox_access_token(self.token)
-
-        fig = go.Figure()  # Create an empty figure
+    def _groups(self) -> dict:
+        '''{forest_type: [indices of the test areas]}'''
+        groups = {}
+        for i, testarea in enumerate(self.testareas):
+            groups.setdefault(testarea.forest_type, []).append(i)
+        return groups
 
-        # Add each polygon to the plot with its specified color
+    def _add_traces(self, fig: go.Figure) -> None:
+        # one trace per polygon, only feasible for a few hundred test areas
         for poly in self.get_polygons():
             fig.add_trace(
                 go.Scattermapbox(
@@ -178,15 +264,114 @@ class MapOverview:
                     f"Forest type: {poly['forest_type']}<br>Info: {poly['info']}<br>",
                 ))
 
+    def _add_bulk(self, fig: go.Figure, mode: str) -> List[dict]:
+        # one NaN-separated line trace or one GeoJSON layer per forest type
+        colors = px.colors.qualitative.Plotly
+        layers = []
+        for k, (forest_type, members) in enumerate(self._groups().items()):
+            color = colors[k % len(colors)]
+            if mode == 'lines':
+                lonlat = _nan_separated(
+                    [self._coords(self.testareas[i]) for i in members])
+                fig.add_trace(
+                    go.Scattermapbox(mode="lines",
+                                     lon=lonlat[:, 0],
+                                     lat=lonlat[:, 1],
+                                     name=forest_type,
+                                     line=dict(color=color),
+                                     connectgaps=False,
+                                     hoverinfo='skip'))
+            else:
+                layers.append({
+                    "sourcetype": "geojson",
+                    "source": {
+                        "type":
+                        "FeatureCollection",
+                        "features": [{
+                            "type": "Feature",
+                            "geometry":
+                            mapping(self.testareas[i].simplified(
+                                tolerance_for_zoom(self.zoom))),
+                            "properties": {
+                                "name": self.testareas[i].name
+                            }
+                        } for i in members]
+                    },
+                    "type": "line",
+                    "color": color,
+                    "line": {
+                        "width": 2
+                    }
+                })
+
+        # hover information of all test areas in a single marker trace
+        fig.add_trace(
+            go.Scattermapbox(mode="markers",
+                             lon=self.centers[:, 0],
+                             lat=self.centers[:, 1],
+                             marker=dict(size=4),
+                             name='test areas',
+                             hoverinfo='text',
+                             text=self._hover_texts(),
+                             showlegend=False))
+        return layers
+
+    def get_map(self,
+                save=False,
+                format='html',
+                mode: str = 'auto',
+                show: bool = True):
+        '''Plots all test areas
+
+        Parameters
+        ----------
+
+        save: bool
+            Write the figure to "map.<format>". Default: False
+        format: str
+            'html' or an image format supported by `fig.write_image`. Default: 'html'
+        mode: str
+            'traces' (one trace per test area), 'lines' (one NaN-separated trace per
+            forest type), 'geojson' (one GeoJSON layer per forest type) or 'auto'
+            ('lines' above `BULK_THRESHOLD` test areas, else 'traces'). Default: 'auto'
+        show: bool
+            Display the figure, set to False for headless batch export. Default: True
+
+        Returns
+        -------
+
+        go.Figure
+        '''
+        if mode == 'auto':
+            mode = 'lines' if len(self.testareas) > BULK_THRESHOLD else 'traces'
+        if mode not in ('traces', 'lines', 'geojson'):
+            raise ValueError(
+                f"mode must be 'auto', 'traces', 'lines' or 'geojson', not '{mode}'"
+            )
+
+        custom_style_url = self.style_url
+        if self.token:
+            px.set_mapbox_access_token(self.token)
+
+        fig = go.Figure()  # Create an empty figure
+
+        layers = []
+        if mode == 'traces':
+            self._add_traces(fig)
+        else:
+            layers = self._add_bulk(fig, mode)
+
+        super_center = self.get_super_center()
         # Update layout with custom Mapbox map
         fig.update_layout(
             mapbox=dict(style=custom_style_url,
                         accesstoken=self.token,
                         zoom=self.zoom,
-                        center=dict(lat=self.get_super_center()[1],
-                                    lon=self.get_super_center()[0])))
+                        center=dict(lat=super_center[1], lon=super_center[0]),
+                        layers=layers))
 
-        fig.show()
+        if show:
+            fig.show()
 
         # Display or save the figure
         if save and format != 'html':
@@ -200,26 +385,28 @@ class MapOverview:
 if __name__ == "__main__":
     test_area_1 = TestArea(name='Test Area 1',
                            forest_type='coniferous',
-                           mask=Polygon(
+                           _geom=mapping(
+                               Polygon(
                                coords_from_google_maps([
                                    (48.365325929665225, 16.491747734015267),
                                    (48.45160471550519, 16.491747734015267),
                                    (48.45160471550519, 16.63199879296561),
                                    (48.365325929665225, 16.63199879296561),
                                    (48.365325929665225, 16.491747734015267)
-                               ])),
+                               ]))),
                            info='predominantly oak forest')
 
     test_area_2 = TestArea(name='Test Area 2',
                            forest_type='mixed',
-                           mask=Polygon(
+                           _geom=mapping(
+                               Polygon(
                                coords_from_google_maps([
                                    (48.59247728447388, 15.476589833711538),
                                    (48.650658311724776, 15.476589833711538),
                                    (48.650658311724776, 15.564157713339654),
                                    (48.59247728447388, 15.564157713339654),
                                    (48.59247728447388, 15.476589833711538)
-                               ])),
+                               ]))),
                            info='mixed forest')
 
     map_austria = MapboxMap(
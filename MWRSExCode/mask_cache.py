@@ -0,0 +1,157 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from testarea import TestArea
+from register_index import DEFAULT_CACHE_DIR
+
+
+class PixelMaskCache:
+    '''Cache of rasterized test area masks per (TestArea, tile, resolution)
+
+    Masks are kept in memory with LRU eviction and on disk as compressed, bit-packed
+    arrays, the least recently used files are removed beyond `max_disk_bytes`. An
+    entry is only reused for a window with the same origin and shape, so new dates
+    can be masked without rasterizing the polygon again.
+
+    Parameters
+    ----------
+
+    cache_dir: Optional[str]
+        Folder of the on-disk cache, None disables it. Default: `DEFAULT_CACHE_DIR/masks`
+    max_entries: int
+        Number of masks kept in memory. Default: 256
+    max_disk_bytes: int
+        Size limit of the on-disk cache. Default: 1 GiB
+    '''
+
+    def __init__(self,
+                 cache_dir: Optional[str] = os.path.join(
+                     DEFAULT_CACHE_DIR, 'masks'),
+                 max_entries: int = 256,
+                 max_disk_bytes: int = 2**30) -> None:
+        self.cache_dir = cache_dir
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(testarea: TestArea, tile: str, resolution: int) -> str:
+        geometry_hash = hashlib.sha1(testarea.shape.wkb).hexdigest()
+        if len(tile) > 64:  # many tiles, keep the file name short
+            tile = hashlib.sha1(tile.encode()).hexdigest()
+        return f'{geometry_hash}_{tile}_{resolution:03}M'
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _load(self, key: str) -> Optional[tuple]:
+        if self.cache_dir is None:
+            return None
+        try:
+            os.utime(self._path(key))  # the modification time orders the eviction
+        except FileNotFoundError:
+            return None
+        with np.load(self._path(key)) as entry:
+            shape = tuple(entry['shape'])
+            mask = np.unpackbits(entry['mask'],
+                                 count=shape[0] * shape[1]).reshape(shape)
+            return mask.astype(bool), float(entry['x0']), float(entry['y0'])
+
+    def _store(self, key: str, entry: tuple) -> None:
+        mask, x0, y0 = entry
+        if self.cache_dir is not None:
+            # written next to the entry and renamed, so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(prefix=f'{key}.',
+                                            suffix='.tmp',
+                                            dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez_compressed(f,
+                                        mask=np.packbits(mask),
+                                        shape=np.array(mask.shape),
+                                        x0=x0,
+                                        y0=y0)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        '''Removes the least recently used files until the cache fits `max_disk_bytes`'''
+        files = sorted((entry for entry in os.scandir(self.cache_dir)
+                        if entry.name.endswith('.npz')),
+                       key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in files)
+        for entry in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:  # removed by another process
+                pass
+
+    def get_or_create(self, testarea: TestArea, tile: str, resolution: int,
+                      x: np.ndarray, y: np.ndarray,
+                      create: Callable[[], np.ndarray]) -> np.ndarray:
+        '''Returns the boolean (y, x) mask of the window, `create()` rasterizes it on a miss
+
+        Parameters
+        ----------
+
+        testarea: TestArea
+            The test area
+        tile: str
+            Equi7 tile name(s) of the window
+        resolution: int
+            Pixel spacing in metres
+        x, y: np.ndarray
+            Pixel coordinates of the window
+        create: Callable[[], np.ndarray]
+            Rasterizes the mask for the window
+
+        Returns
+        -------
+
+        np.ndarray
+            Read-only boolean mask with shape (len(y), len(x))
+        '''
+        key = self.key(testarea, tile, resolution)
+        shape = (len(y), len(x))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+
+        if entry is None or entry[0].shape != shape or (
+                shape[0] and shape[1] and (entry[1], entry[2]) !=
+            (float(x[0]), float(y[0]))):
+            mask = np.asarray(create(), dtype=bool)
+            entry = (mask, float(x[0]) if len(x) else 0.,
+                     float(y[0]) if len(y) else 0.)
+            self._store(key, entry)
+        entry[0].flags.writeable = False
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,354 @@
+import hashlib
+import threading
+import warnings
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from yeoda.products.base import ProductDataCube
+
+from mask_cache import PixelMaskCache
+from products import get_product
+from testarea import TestArea
+from timeseries_by_geom import (DataCubeLoader, TemporalWindow,
+                                TimeSeriesByGeom, decode)
+
+_LOADERS: Dict[tuple, DataCubeLoader] = {}
+_LOADERS_LOCK = threading.Lock()
+
+
+def get_loader(product: str = 'sig0',
+               resolution: Optional[int] = None,
+               root_path: Optional[str] = None,
+               index_path: Optional[str] = None,
+               mask_cache: Optional[PixelMaskCache] = None) -> DataCubeLoader:
+    '''Process-wide shared DataCubeLoader per (product, resolution, root path, mask cache)
+
+    All loaders use the same SQLite file register (one table, keyed by root folder),
+    so every product is scanned once and its datacube is built once per process.
+
+    Parameters
+    ----------
+
+    product: str
+        Registered product, see products.py. Default: 'sig0'
+    resolution: Optional[int]
+        Pixel spacing [m]. Default: None (the first resolution of the product)
+    root_path: Optional[str]
+        Folder of the product. Default: None (shared datasets)
+    index_path: Optional[str]
+        Path of the SQLite file register. Default: None (`DEFAULT_CACHE_DIR`)
+    mask_cache: Optional[PixelMaskCache]
+        Mask cache of the loader. Default: None (the loader's own default cache)
+
+    Returns
+    -------
+
+    DataCubeLoader
+    '''
+    spec = get_product(product)
+    resolution = resolution or spec.resolutions[0]
+    # the mask cache object is part of the key, another cache gets its own loader
+    key = (spec.name, resolution, root_path, index_path, mask_cache)
+    with _LOADERS_LOCK:
+        if key not in _LOADERS:
+            _LOADERS[key] = DataCubeLoader(resolution=resolution,
+                                           index_path=index_path,
+                                           mask_cache=mask_cache,
+                                           root_path=root_path,
+                                           product=spec)
+        return _LOADERS[key]
+
+
+def _unique_times(data: xr.DataArray) -> xr.DataArray:
+    data = data.sortby('time')
+    _, first = np.unique(data.time.values, return_index=True)
+    return data.isel(time=first)
+
+
+def nearest_join(reference_times: np.ndarray, data: xr.DataArray,
+                 tolerance: Union[str, pd.Timedelta]) -> xr.DataArray:
+    '''Values of the acquisition closest to every reference time (NaN beyond `tolerance`)
+
+    Parameters
+    ----------
+
+    reference_times: np.ndarray
+        datetime64 times to align to
+    data: xr.DataArray
+        Data with a 'time' dimension
+    tolerance: Union[str, pd.Timedelta]
+        Maximum time difference, e.g. '3D'
+
+    Returns
+    -------
+
+    xr.DataArray
+        `data` with the 'time' dimension of `reference_times`
+    '''
+    return _unique_times(data).reindex(time=reference_times,
+                                       method='nearest',
+                                       tolerance=pd.Timedelta(tolerance))
+
+
+def windowed_join(reference_times: np.ndarray, data: xr.DataArray,
+                  window: Union[str, pd.Timedelta]) -> xr.DataArray:
+    '''Mean of the valid values within +-window/2 of every reference time
+
+    All windows are evaluated at once with cumulative sums along time and two
+    `searchsorted` calls, independent of the number of pixels and windows.
+
+    Parameters
+    ----------
+
+    reference_times: np.ndarray
+        datetime64 times to align to
+    data: xr.DataArray
+        Data with a 'time' dimension, NaN for missing values
+    window: Union[str, pd.Timedelta]
+        Width of the window centred on every reference time, e.g. '16D'
+
+    Returns
+    -------
+
+    xr.DataArray
+        `data` with the 'time' dimension of `reference_times`
+    '''
+    data = data.sortby('time').transpose('time', ...)
+    values = np.asarray(data.values, dtype=np.float64)
+    valid = np.isfinite(values)
+    zeros = np.zeros((1, *values.shape[1:]))
+    sums = np.concatenate(
+        [zeros, np.cumsum(np.where(valid, values, 0.), axis=0)])
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+
+    times = data.time.values.astype('datetime64[ns]')
+    reference_times = np.asarray(reference_times, dtype='datetime64[ns]')
+    half = np.timedelta64(pd.Timedelta(window).value // 2, 'ns')
+    start = np.searchsorted(times, reference_times - half, side='left')
+    stop = np.searchsorted(times, reference_times + half, side='right')
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums[stop] - sums[start]) / (counts[stop] - counts[start])
+    return xr.DataArray(mean.astype(np.float32),
+                        dims=data.dims,
+                        coords={
+                            **{
+                                name: coord
+                                for name, coord in data.coords.items()
+                                if 'time' not in coord.dims
+                            }, 'time': reference_times
+                        },
+                        attrs=data.attrs)
+
+
+def _physical(dataset: xr.Dataset, loader: DataCubeLoader) -> xr.DataArray:
+    '''Float values of a loaded window, nodata as NaN'''
+    data = dataset['data']
+    if 'scale_factor' in data.attrs:
+        return decode(data)
+    if loader.nodata is not None:
+        data = data.where(data != loader.nodata)
+    data = data.astype(np.float32)
+    if loader.scale_factor and not issubclass(loader.product.datacube_class,
+                                              ProductDataCube):
+        # only ProductDataCubes apply the scale factor, e.g. S2 digital numbers
+        data = data / np.float32(loader.scale_factor)
+    return data
+
+
+def _align_spatially(data: xr.DataArray, reference: xr.DataArray,
+                     resolution: int) -> xr.DataArray:
+    '''Nearest pixel of `data` (with spacing `resolution`) for every reference pixel'''
+    if (np.array_equal(data.x.values, reference.x.values)
+            and np.array_equal(data.y.values, reference.y.values)):
+        return data
+    return data.reindex(x=reference.x,
+                        y=reference.y,
+                        method='nearest',
+                        tolerance=resolution)
+
+
+class MultiProductLoader:
+    '''Loads several products for the same test areas and joins them in time and space
+
+    The products share the file register, the loaders (see `get_loader`) and the tiles
+    found for a test area, so the spatial search runs once per test area and grid.
+
+    Parameters
+    ----------
+
+    products: Optional[Dict[str, Optional[int]]]
+        {product: resolution}, None for the default resolution of the product.
+        Default: None ({'sig0': 10})
+    filters: Optional[Dict[str, dict]]
+        Dimension filters per product, e.g. {'sig0': {'pol': 'VV'}, 's2': {'var_name':
+        'B08'}}. Every product should be reduced to one variable. Default: None
+    root_paths: Optional[Dict[str, str]]
+        Product folders other than the shared datasets. Default: None
+    index_path: Optional[str]
+        Path of the SQLite file register. Default: None (`DEFAULT_CACHE_DIR`)
+    mask_cache: Optional[PixelMaskCache]
+        Mask cache of the loaders. Default: None
+    '''
+
+    def __init__(self,
+                 products: Optional[Dict[str, Optional[int]]] = None,
+                 filters: Optional[Dict[str, dict]] = None,
+                 root_paths: Optional[Dict[str, str]] = None,
+                 index_path: Optional[str] = None,
+                 mask_cache: Optional[PixelMaskCache] = None) -> None:
+        if products is None:
+            products = {'sig0': 10}
+        root_paths = root_paths or {}
+        self.loaders = {
+            product: get_loader(product,
+                                resolution,
+                                root_path=root_paths.get(product),
+                                index_path=index_path,
+                                mask_cache=mask_cache)
+            for product, resolution in products.items()
+        }
+        self.filters = filters or {}
+        self._tiles: Dict[tuple, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def tiles(self, testarea: TestArea, resolution: int) -> List[str]:
+        '''Equi7 tiles of `resolution` intersecting `testarea`, searched once'''
+        key = (hashlib.sha1(testarea.shape.wkb).hexdigest(), resolution)
+        with self._lock:
+            if key in self._tiles:
+                return self._tiles[key]
+
+        loader = next(loader for loader in self.loaders.values()
+                      if loader.resolution == resolution)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            inventory = loader.datacube.filter_spatially_by_geom(
+                testarea.bbox, sref=loader.sref).inventory
+        tiles = sorted(inventory['tile'].unique())
+        with self._lock:
+            self._tiles[key] = tiles
+        return tiles
+
+    def datacube(self,
+                 product: str,
+                 testarea: TestArea,
+                 temporal_window: Optional[TemporalWindow] = None
+                 ) -> ProductDataCube:
+        '''Datacube of `product` reduced to the tiles of `testarea`, the filters and time'''
+        loader = self.loaders[product]
+        tiles = self.tiles(testarea, loader.resolution)
+        if not tiles:
+            raise ValueError(f'No {product} data found for {testarea.name}')
+
+        datacube = loader.datacube.filter_by_dimension(tiles, name='tile')
+        for dimension, value in self.filters.get(product, {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            datacube = datacube.filter_by_dimension(list(values),
+                                                    name=dimension)
+        if temporal_window is not None and not loader.product.is_static:
+            datacube = datacube.filter_by_dimension(
+                [(temporal_window.start, temporal_window.end)], [('>=', '<')],
+                name='time')
+        if len(datacube) == 0:
+            raise ValueError(f'No {product} data found for {testarea.name}')
+        return datacube
+
+    def masked_arrays(self,
+                      testarea: TestArea,
+                      temporal_window: Optional[TemporalWindow] = None,
+                      apply_mask: bool = False,
+                      **masked_array_kwargs) -> Dict[str, xr.Dataset]:
+        '''(time, y, x) window of every product, each on its own grid'''
+        return {
+            product:
+            TimeSeriesByGeom(testarea, loader).masked_array(
+                self.datacube(product, testarea, temporal_window),
+                apply_mask=apply_mask,
+                **masked_array_kwargs)
+            for product, loader in self.loaders.items()
+        }
+
+    def join(self,
+             testarea: TestArea,
+             reference: str = 'sig0',
+             how: str = 'nearest',
+             tolerance: Union[str, pd.Timedelta] = '6D',
+             window: Union[str, pd.Timedelta] = '16D',
+             temporal_window: Optional[TemporalWindow] = None,
+             apply_mask: bool = True,
+             **masked_array_kwargs) -> xr.Dataset:
+        '''All products of a test area on the time steps and pixels of `reference`
+
+        Every other product is first aligned in time on its own grid (one vectorized
+        operation for all pixels), then resampled to the reference pixels (nearest
+        neighbour). Static products (e.g. 'parameters') keep only the (y, x) dims.
+
+        Parameters
+        ----------
+
+        testarea: TestArea
+            The test area
+        reference: str
+            Product providing the time steps and the pixel grid. Default: 'sig0'
+        how: str
+            'nearest' (closest acquisition within `tolerance`) or 'window' (mean of the
+            acquisitions within +-window/2). Default: 'nearest'
+        tolerance: Union[str, pd.Timedelta]
+            Maximum time difference of the nearest join. Default: '6D'
+        window: Union[str, pd.Timedelta]
+            Window width of the windowed join. Default: '16D'
+        temporal_window: Optional[TemporalWindow]
+            Time range of all products. Default: None
+        apply_mask: bool
+            Mask the pixels outside of the test area (on the reference grid). Default: True
+        **masked_array_kwargs
+            Passed on to `masked_array`, e.g. `prefetch`
+
+        Returns
+        -------
+
+        xr.Dataset
+            One float variable per product, NaN where no value could be aligned
+        '''
+        if how not in ('nearest', 'window'):
+            raise ValueError(f"how must be 'nearest' or 'window', not '{how}'")
+        if reference not in self.loaders:
+            raise ValueError(f'The reference {reference} is not loaded')
+
+        arrays = self.masked_arrays(testarea, temporal_window, False,
+                                    **masked_array_kwargs)
+        reference_loader = self.loaders[reference]
+        reference_data = _physical(arrays[reference], reference_loader)
+
+        joined = {reference: reference_data}
+        for product, dataset in arrays.items():
+            if product == reference:
+                continue
+            loader = self.loaders[product]
+            data = _physical(dataset, loader)
+            if loader.product.is_static:
+                if 'time' in data.dims:
+                    data = data.isel(time=0, drop=True)
+            elif how == 'nearest':
+                data = nearest_join(reference_data.time.values, data,
+                                    tolerance)
+            else:
+                data = windowed_join(reference_data.time.values, data, window)
+            joined[product] = _align_spatially(data, reference_data,
+                                               loader.resolution)
+
+        result = xr.Dataset(joined,
+                            attrs={
+                                'reference': reference,
+                                'how': how,
+                                'tiles': arrays[reference].attrs.get('tiles')
+                            })
+        if apply_mask:
+            mask = reference_loader.pixel_mask(
+                testarea, arrays[reference].attrs['tiles'].split(','),
+                result.x.values, result.y.values)
+            result = result.where(xr.DataArray(mask, dims=('y', 'x')))
+        return result
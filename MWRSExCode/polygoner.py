@@ -1,70 +1,300 @@
 import geopandas as gpd
-from shapely.geometry import mapping
+from shapely.geometry import box, mapping
+import json
 import os
 from pathlib import Path
-import shutil
+from typing import Dict, List, Optional, Tuple
 
+from instrumentation import count, stage
 
-def get_polygon_by_id(
-    target_id: any,
-    id_column: str = "ID",
-) -> int:
 
+def default_shapefile_path() -> str:
     USER = os.getcwd().split('/')[2]
-    at_shapefile_path: str = os.path.join(
+    return os.path.join(
         f'/home/{USER}/shared/120.030-2023W/groups/PracticalExGr_3/eo_processing/clc/CLC18_AT_clip.shp'
     )
 
-    if not os.path.isfile(at_shapefile_path):
-        raise FileNotFoundError(
-            f'The specified shapefile {at_shapefile_path} does not exist.')
-    else:
-        print(f'Specified Austria Shape File exists and will be loaded...')
 
-    testareas_dir_path = str(Path(at_shapefile_path).resolve().parent)
+def _source_signature(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
 
-    if os.path.exists(os.path.join(testareas_dir_path, target_id)):
-        # user_confirm = input(f'Shp file already exists! Overwrite? [y/n]').lower()
 
-        if 1 == 2:  # user_confirm == 'y':
-            shutil.rmtree(os.path.join(testareas_dir_path, target_id))
-        else:
-            print(
-                f'Found previously extracted data for ID {target_id}: {os.path.join(testareas_dir_path, target_id, target_id + ".shp")}'
-            )
-            extent = gpd.read_file(
-                os.path.join(testareas_dir_path, target_id,
-                             target_id + ".shp"))
+class ShapefileIndex:
+    '''Indexed access to the features of a (large) shapefile
 
-            if extent.geometry.iloc[0] is None:
-                raise ValueError('Invalid geometry')
-            else:
-                return mapping(extent.geometry.iloc[0])
+    A sidecar JSON file maps every ID to its feature offset, so single IDs are read
+    with a random access instead of loading the whole layer. The sidecar is rebuilt
+    when the shapefile changes.
 
-    print(f'Extracting data for ID {target_id}...')
-    # Make a new directory for extracted polygons
-    os.mkdir(os.path.join(testareas_dir_path, target_id))
+    Parameters
+    ----------
 
-    testareas_dir_path = os.path.join(testareas_dir_path, target_id)
-    gdf = gpd.read_file(at_shapefile_path)
+    shapefile_path: str
+        Path of the shapefile, e.g. `default_shapefile_path()`
+    id_column: str
+        Attribute holding the feature IDs. Default: "ID"
+    index_path: Optional[str]
+        Path of the sidecar file. Default: `<shapefile_path>.<id_column>.idx.json`
+    '''
 
-    if id_column not in gdf.columns:
-        raise ValueError(f"{id_column} not found in GeoDataFrame.")
+    def __init__(self,
+                 shapefile_path: str,
+                 id_column: str = "ID",
+                 index_path: Optional[str] = None) -> None:
+        if not os.path.isfile(shapefile_path):
+            raise FileNotFoundError(
+                f'The specified shapefile {shapefile_path} does not exist.')
 
-    # Select row with corresponding id
-    selected_polygon = gdf[gdf[id_column] == target_id].to_crs("EPSG:4326")
+        self.shapefile_path = shapefile_path
+        self.id_column = id_column
+        self.index_path = index_path or f'{shapefile_path}.{id_column}.idx.json'
+        self._offsets, self._offsets_signature = None, None
+        self._gdf, self._gdf_signature = None, None
 
-    if selected_polygon.empty:
-        raise ValueError(f"No polygon with {id_column} == {target_id}.")
+    @property
+    def offsets(self) -> Dict[str, int]:
+        '''{str(ID): feature offset}, loaded from or written to the sidecar file'''
+        signature = _source_signature(self.shapefile_path)
+        if self._offsets is not None and self._offsets_signature == signature:
+            return self._offsets
 
-    geom = mapping(selected_polygon.geometry.iloc[0])
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as f:
+                sidecar = json.load(f)
+            if sidecar['source'] == signature:
+                self._offsets = sidecar['offsets']
+                self._offsets_signature = signature
+                return self._offsets
 
-    if selected_polygon.empty:
-        raise ValueError(
-            f"No polygon found with {id_column} equal to {target_id}.")
+        # attributes only, the geometries are not needed for the index
+        attributes = gpd.read_file(self.shapefile_path, ignore_geometry=True)
+        if self.id_column not in attributes.columns:
+            raise ValueError(f"{self.id_column} not found in GeoDataFrame.")
+
+        offsets = {}
+        for offset, target_id in enumerate(attributes[self.id_column]):
+            offsets.setdefault(str(target_id), offset)
+
+        try:
+            with open(self.index_path, 'w') as f:
+                json.dump({'source': signature, 'offsets': offsets}, f)
+        except OSError:
+            print(f'Could not write index file {self.index_path}')
+
+        self._offsets, self._offsets_signature = offsets, signature
+        return self._offsets
+
+    @property
+    def crs(self):
+        return gpd.read_file(self.shapefile_path, rows=1).crs
+
+    def read_by_id(self, target_id: any) -> gpd.GeoDataFrame:
+        '''Reads the feature with `id_column == target_id` (source CRS)'''
+        offset = self.offsets.get(str(target_id))
+        if offset is None:
+            raise ValueError(
+                f"No polygon with {self.id_column} == {target_id}.")
+        with stage('shapefile_read'):
+            count(files=1)
+            return gpd.read_file(self.shapefile_path,
+                                 rows=slice(offset, offset + 1))
+
+    def read_by_bbox(self,
+                     bbox: Tuple[float, float, float, float],
+                     crs: str = "EPSG:4326") -> gpd.GeoDataFrame:
+        '''Reads only the features intersecting `bbox` = (min_x, min_y, max_x, max_y)'''
+        bounds = gpd.GeoSeries([box(*bbox)],
+                               crs=crs).to_crs(self.crs).total_bounds
+        with stage('shapefile_read'):
+            count(files=1)
+            return gpd.read_file(self.shapefile_path, bbox=tuple(bounds))
+
+    @property
+    def geodataframe(self) -> gpd.GeoDataFrame:
+        '''The whole layer, read once and kept for spatial queries'''
+        signature = _source_signature(self.shapefile_path)
+        if self._gdf is None or self._gdf_signature != signature:
+            with stage('shapefile_read'):
+                count(files=1, bytes_read=os.path.getsize(self.shapefile_path))
+                self._gdf = gpd.read_file(self.shapefile_path)
+            self._gdf_signature = signature
+        return self._gdf
+
+    def query(self,
+              geom,
+              predicate: str = 'intersects',
+              crs: str = "EPSG:4326") -> gpd.GeoDataFrame:
+        '''STRtree query of the whole layer, e.g. all features intersecting `geom`'''
+        gdf = self.geodataframe
+        geom = gpd.GeoSeries([geom], crs=crs).to_crs(gdf.crs).iloc[0]
+        return gdf.iloc[gdf.sindex.query(geom, predicate=predicate)]
+
+
+_INDEXES: Dict[tuple, ShapefileIndex] = {}
+
+
+def get_index(shapefile_path: Optional[str] = None,
+              id_column: str = "ID") -> ShapefileIndex:
+    '''Returns the (per process shared) ShapefileIndex of `shapefile_path`'''
+    if shapefile_path is None:
+        shapefile_path = default_shapefile_path()
+    key = (shapefile_path, id_column)
+    if key not in _INDEXES:
+        _INDEXES[key] = ShapefileIndex(shapefile_path, id_column=id_column)
+    return _INDEXES[key]
+
+
+def _polygon_cache_paths(shapefile_path: str,
+                         id_column: str,
+                         cache_dir: Optional[str] = None) -> Tuple[str, str]:
+    if cache_dir is None:
+        cache_dir = str(Path(shapefile_path).resolve().parent)
+    cache_path = os.path.join(
+        cache_dir, f'{Path(shapefile_path).stem}.{id_column}.EPSG4326.parquet')
+    return cache_path, cache_path + '.json'
+
+
+def _polygon_cache_is_fresh(shapefile_path: str,
+                            id_column: str,
+                            cache_dir: Optional[str] = None) -> bool:
+    cache_path, meta_path = _polygon_cache_paths(shapefile_path, id_column,
+                                                 cache_dir)
+    if not (os.path.isfile(cache_path) and os.path.isfile(meta_path)):
+        return False
+    with open(meta_path) as f:
+        return json.load(f)['source'] == _source_signature(shapefile_path)
+
+
+def build_polygon_cache(shapefile_path: Optional[str] = None,
+                        id_column: str = "ID",
+                        cache_dir: Optional[str] = None) -> str:
+    '''Reads and reprojects the shapefile once and stores it as one GeoParquet file
+
+    Parameters
+    ----------
+
+    shapefile_path: Optional[str]
+        Path of the shapefile. Default: None (`default_shapefile_path()`)
+    id_column: str
+        Attribute holding the feature IDs. Default: "ID"
+    cache_dir: Optional[str]
+        Folder of the cache. Default: None (folder of the shapefile)
+
+    Returns
+    -------
 
-    file = os.path.join(testareas_dir_path, target_id + '.shp')
-    print(f'All data extracted! Created new shp file in path: \n {file}')
-    selected_polygon.to_file(file)
+    str
+        Path of the GeoParquet cache
+    '''
+    if shapefile_path is None:
+        shapefile_path = default_shapefile_path()
+    cache_path, meta_path = _polygon_cache_paths(shapefile_path, id_column,
+                                                 cache_dir)
+    signature = _source_signature(shapefile_path)
+
+    with stage('polygon_cache_build'):
+        count(files=1, bytes_read=os.path.getsize(shapefile_path))
+        gdf = gpd.read_file(shapefile_path)
+        if id_column not in gdf.columns:
+            raise ValueError(f"{id_column} not found in GeoDataFrame.")
+
+        gdf = gdf.to_crs("EPSG:4326")
+        gdf[id_column] = gdf[id_column].astype(str)
+        # sorted IDs keep the row group statistics tight for filtered reads
+        gdf = gdf.drop_duplicates(id_column).sort_values(id_column)
+        gdf.to_parquet(cache_path, index=False, row_group_size=10000)
+
+    with open(meta_path, 'w') as f:
+        json.dump({'source': signature, 'id_column': id_column}, f)
+    return cache_path
+
+
+def get_polygons_by_ids(target_ids: List[any],
+                        id_column: str = "ID",
+                        shapefile_path: Optional[str] = None,
+                        cache_dir: Optional[str] = None) -> Dict[any, dict]:
+    '''Returns the EPSG:4326 geometries (`shapely.geometry.mapping`) of many IDs at once
+
+    The geometries come from a GeoParquet cache of the whole shapefile, which is
+    (re)built with a single read and reprojection whenever the shapefile changed.
+
+    Parameters
+    ----------
+
+    target_ids: List[any]
+        The IDs to look up
+    id_column: str
+        Attribute holding the feature IDs. Default: "ID"
+    shapefile_path: Optional[str]
+        Path of the shapefile. Default: None (`default_shapefile_path()`)
+    cache_dir: Optional[str]
+        Folder of the cache. Default: None (folder of the shapefile)
+
+    Returns
+    -------
+
+    Dict[any, dict]
+        {target_id: geometry mapping}, in the order of `target_ids`
+    '''
+    if shapefile_path is None:
+        shapefile_path = default_shapefile_path()
+    if not os.path.isfile(shapefile_path):
+        raise FileNotFoundError(
+            f'The specified shapefile {shapefile_path} does not exist.')
+
+    if not _polygon_cache_is_fresh(shapefile_path, id_column, cache_dir):
+        print(f'Building polygon cache of {shapefile_path}...')
+        build_polygon_cache(shapefile_path, id_column, cache_dir)
+    cache_path, _ = _polygon_cache_paths(shapefile_path, id_column, cache_dir)
+
+    ids = sorted({str(target_id) for target_id in target_ids})
+    with stage('polygon_lookup'):
+        count(files=1)
+        selected = gpd.read_parquet(cache_path,
+                                    filters=[(id_column, 'in', ids)])
+    geometries = dict(zip(selected[id_column], selected.geometry))
+
+    missing = [
+        target_id for target_id in target_ids
+        if str(target_id) not in geometries
+    ]
+    if missing:
+        raise ValueError(f"No polygon with {id_column} in {missing}.")
+
+    polygons = {}
+    for target_id in target_ids:
+        geometry = geometries[str(target_id)]
+        if geometry is None:
+            raise ValueError(f'Invalid geometry for {id_column} {target_id}')
+        polygons[target_id] = mapping(geometry)
+    return polygons
+
+
+def get_polygon_by_id(target_id: any,
+                      id_column: str = "ID",
+                      shapefile_path: Optional[str] = None) -> dict:
+    '''Returns the EPSG:4326 geometry (`shapely.geometry.mapping`) of a single ID
+
+    Uses the GeoParquet cache of `get_polygons_by_ids` if it is up to date, otherwise
+    an indexed read of just this feature from the shapefile.
+    '''
+    if shapefile_path is None:
+        shapefile_path = default_shapefile_path()
+    if not os.path.isfile(shapefile_path):
+        raise FileNotFoundError(
+            f'The specified shapefile {shapefile_path} does not exist.')
+
+    if _polygon_cache_is_fresh(shapefile_path, id_column):
+        return get_polygons_by_ids([target_id], id_column,
+                                   shapefile_path)[target_id]
+
+    selected_polygon = get_index(
+        shapefile_path, id_column).read_by_id(target_id).to_crs("EPSG:4326")
+
+    if selected_polygon.empty:
+        raise ValueError(f"No polygon with {id_column} == {target_id}.")
+    if selected_polygon.geometry.iloc[0] is None:
+        raise ValueError('Invalid geometry')
 
-    return geom
+    return mapping(selected_polygon.geometry.iloc[0])
@@ -0,0 +1,88 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple, TypeVar
+
+import numpy as np
+
+Item = TypeVar('Item')
+Result = TypeVar('Result')
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+_DONE = object()
+
+
+def nbytes(result) -> int:
+    '''Size of a loaded window (xarray/numpy object or a tuple of them) in bytes'''
+    if isinstance(result, (tuple, list)):
+        return sum(nbytes(part) for part in result)
+    return int(getattr(result, 'nbytes', 0))
+
+
+class PrefetchReader:
+    '''Reads the next items in a bounded thread pool while the current one is processed
+
+    Results are yielded in input order. At most `queue_depth` reads are in flight or
+    waiting to be consumed, and fewer if their estimated size (the size of the last
+    result) would exceed `max_bytes`. One read is always allowed, so a single window
+    larger than the cap is still loaded.
+
+    Parameters
+    ----------
+
+    read: Callable[[Item], Result]
+        Reads one item, e.g. the window of one file or one date. Runs in the pool, so
+        it must not share non thread-safe objects (e.g. an OSR SpatialReference)
+    queue_depth: int
+        Maximum number of reads ahead of the consumer. Default: 4
+    n_workers: int
+        Number of reading threads. Default: 2
+    max_bytes: Optional[int]
+        Memory cap of the prefetched results, None disables it. Default: 512 MiB
+    '''
+
+    def __init__(self,
+                 read: Callable[[Item], Result],
+                 queue_depth: int = 4,
+                 n_workers: int = 2,
+                 max_bytes: Optional[int] = DEFAULT_MAX_BYTES) -> None:
+        if queue_depth < 1:
+            raise ValueError(f'queue_depth must be >= 1, not {queue_depth}')
+        self.read = read
+        self.queue_depth = queue_depth
+        self.n_workers = n_workers
+        self.max_bytes = max_bytes
+        self._estimate = 0  # size of the last result in bytes
+
+    def _capacity(self) -> int:
+        if not self.max_bytes or not self._estimate:
+            return self.queue_depth
+        return int(
+            np.clip(self.max_bytes // self._estimate, 1, self.queue_depth))
+
+    def iter(self, items: Iterable[Item]) -> Iterator[Tuple[Item, Result]]:
+        '''Yields (item, result) pairs in the order of `items`'''
+        items = iter(items)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            try:
+                while True:
+                    while len(pending) < self._capacity():
+                        item = next(items, _DONE)
+                        if item is _DONE:
+                            break
+                        pending.append((item, pool.submit(self.read, item)))
+                    if not pending:
+                        return
+
+                    item, future = pending.popleft()
+                    result = future.result()
+                    self._estimate = nbytes(result) or self._estimate
+                    yield item, result
+            finally:
+                # the consumer stopped early or a read failed
+                for _, future in pending:
+                    future.cancel()
+
+    def __call__(self,
+                 items: Iterable[Item]) -> Iterator[Tuple[Item, Result]]:
+        return self.iter(items)
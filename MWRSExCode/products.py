@@ -0,0 +1,146 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from geopathfinder.naming_conventions.acube_naming import ACubeFilename
+from geopathfinder.naming_conventions.sgrt_naming import SgrtFilename
+from yeoda.datacube import EODataCube
+from yeoda.products.base import ProductDataCube
+
+
+def data_root() -> str:
+    '''Root of the shared datasets, e.g. /home/<user>/shared/datasets/fe/data'''
+    USER = os.getcwd().split('/')[2]
+    return f'/home/{USER}/shared/datasets/fe/data'
+
+
+@dataclass(frozen=True)
+class ProductSpec:
+    '''Layout and datacube settings of an archive product
+
+    Parameters
+    ----------
+
+    name: str
+        Product name, e.g. 'sig0'
+    root: str
+        Folder of the product relative to `data_root()`, formatted with the resolution,
+        e.g. 'sentinel1/preprocessed/EU{resolution:03}M'
+    folder_hierarchy: Tuple[str, ...]
+        Names of the folder levels below the root
+    dimensions: Tuple[str, ...]
+        Filename fields used as datacube dimensions
+    filename_class: type
+        geopathfinder filename class
+    resolutions: Tuple[int, ...]
+        Available pixel spacings [m], the first one is the default
+    time_dimension: Optional[str]
+        Dimension holding the acquisition time, None for static products. Default: 'time'
+    tile_dimension: str
+        Dimension holding the Equi7 tile name, renamed to 'tile'. Default: 'tile_name'
+    scale_factor: Optional[float]
+        Stored value = physical value * scale_factor. Default: None (not scaled)
+    nodata: Optional[int]
+        Nodata value of the files. Default: None
+    dtype: str
+        Data type of the stored values. Default: 'int16'
+    datacube_class: type
+        yeoda datacube class. Default: ProductDataCube
+    datacube_kwargs: dict
+        Additional arguments of `datacube_class`. Default: {}
+    '''
+    name: str
+    root: str
+    folder_hierarchy: Tuple[str, ...]
+    dimensions: Tuple[str, ...]
+    filename_class: type
+    resolutions: Tuple[int, ...] = (10, )
+    time_dimension: Optional[str] = 'time'
+    tile_dimension: str = 'tile_name'
+    scale_factor: Optional[float] = None
+    nodata: Optional[int] = None
+    dtype: str = 'int16'
+    datacube_class: type = ProductDataCube
+    datacube_kwargs: dict = field(default_factory=dict, hash=False)
+
+    def root_path(self, resolution: int, root: Optional[str] = None) -> str:
+        '''Folder of the product at `resolution` below `root`. Default: `data_root()`'''
+        return os.path.join(root or data_root(),
+                            self.root.format(resolution=resolution))
+
+    @property
+    def is_static(self) -> bool:
+        return self.time_dimension is None
+
+    @property
+    def itemsize(self) -> int:
+        '''Bytes per stored value'''
+        return np.dtype(self.dtype).itemsize
+
+
+PRODUCTS: Dict[str, ProductSpec] = {}
+
+
+def register_product(spec: ProductSpec) -> ProductSpec:
+    '''Adds (or replaces) a product of the registry'''
+    PRODUCTS[spec.name] = spec
+    return spec
+
+
+def get_product(product: Union[str, ProductSpec]) -> ProductSpec:
+    if isinstance(product, ProductSpec):
+        return product
+    if product not in PRODUCTS:
+        raise ValueError(
+            f'Unknown product {product}, registered are {list(PRODUCTS)}')
+    return PRODUCTS[product]
+
+
+# Layouts as in the notebooks: Sentinel-1 and Copernicus folders are <tile>/<quantity>,
+# Sentinel-2 L2A folders <sub_grid>/<tile_name>/<var_name>
+register_product(
+    ProductSpec(name='sig0',
+                root='sentinel1/preprocessed/EU{resolution:03}M',
+                folder_hierarchy=('tile', 'quantity'),
+                dimensions=('time', 'var_name', 'tile_name', 'pol'),
+                filename_class=SgrtFilename,
+                resolutions=(10, 500),
+                scale_factor=100,
+                nodata=-9999))
+
+register_product(
+    ProductSpec(name='parameters',
+                root='sentinel1/parameters/EU{resolution:03}M',
+                folder_hierarchy=('tile', 'quantity'),
+                dimensions=('var_name', 'relative_orbit', 'tile'),
+                filename_class=SgrtFilename,
+                resolutions=(10, ),
+                time_dimension=None,
+                tile_dimension='tile'))
+
+register_product(
+    ProductSpec(name='ndvi',
+                root='auxiliary_data/copernicus_ndvi/EU{resolution:03}M',
+                folder_hierarchy=('tile', 'quantity'),
+                dimensions=('time', 'tile'),
+                filename_class=SgrtFilename,
+                resolutions=(500, ),
+                tile_dimension='tile'))
+
+register_product(
+    ProductSpec(name='s2',
+                root='sentinel2/L2A',
+                folder_hierarchy=('sub_grid', 'tile_name', 'var_name'),
+                dimensions=('var_name', 'dtime_1', 'dtime_2', 'tile_name'),
+                filename_class=ACubeFilename,
+                resolutions=(10, ),
+                time_dimension='dtime_1',
+                scale_factor=10000,  # L2A digital numbers = reflectance * 10000
+                nodata=0,
+                dtype='uint16',
+                datacube_class=EODataCube,
+                datacube_kwargs={
+                    'sdim_name': 'tile_name',
+                    'tdim_name': 'dtime_1'
+                }))
@@ -0,0 +1,199 @@
+import os
+import re
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from geopathfinder.naming_conventions.sgrt_naming import SgrtFilename
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mwrs23')
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS folders (
+           root TEXT NOT NULL,
+           folder TEXT NOT NULL,
+           mtime_ns INTEGER NOT NULL,
+           PRIMARY KEY (root, folder))''',
+    '''CREATE TABLE IF NOT EXISTS files (
+           root TEXT NOT NULL,
+           folder TEXT NOT NULL,
+           filepath TEXT NOT NULL,
+           tile_name TEXT,
+           var_name TEXT,
+           time TEXT,
+           pol TEXT,
+           PRIMARY KEY (root, filepath))''',
+    '''CREATE INDEX IF NOT EXISTS files_by_key
+           ON files (root, tile_name, var_name, time, pol)''',
+]
+
+
+def parse_sgrt_keys(filename: str) -> Tuple[Optional[str], Optional[str]]:
+    '''Returns the (time, pol) key of an SGRT filename, (None, None) if it does not parse'''
+    try:
+        sgrt_filename = SgrtFilename.from_filename(filename, convert=True)
+        time = sgrt_filename['dtime_1']
+        pol = sgrt_filename['pol']
+    except (ValueError, KeyError, TypeError):
+        return None, None
+
+    if isinstance(time, datetime):
+        time = time.isoformat()
+    return time, pol
+
+
+class FileRegisterIndex:
+    '''On-disk (SQLite) index of the GeoTIFFs below a datacube root folder
+
+    Drop-in replacement for the `file_register` of `build_smarttree`. Every
+    leaf folder of the `folder_hierarchy` is stored together with its mtime,
+    so `refresh()` only rescans the folders that changed since the last run.
+
+    Parameters
+    ----------
+
+    root_path: str
+        Root folder of the datacube, e.g. `.../sentinel1/preprocessed/EU010M`
+    folder_hierarchy: List[str]
+        Names of the folder levels below `root_path`, e.g. ["tile_name", "var_name"]
+    register_file_pattern: str
+        Regex a filename has to match to be registered. Default: "^[^Q].*.tif$"
+    index_path: Optional[str]
+        Path of the SQLite file. Default: `DEFAULT_CACHE_DIR/file_register.sqlite`
+    '''
+
+    def __init__(self,
+                 root_path: str,
+                 folder_hierarchy: List[str],
+                 register_file_pattern: str = "^[^Q].*.tif$",
+                 index_path: Optional[str] = None) -> None:
+        self.root_path = os.path.normpath(root_path)
+        self.folder_hierarchy = folder_hierarchy
+        self.register_file_pattern = re.compile(register_file_pattern)
+
+        if index_path is None:
+            index_path = os.path.join(DEFAULT_CACHE_DIR,
+                                      'file_register.sqlite')
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)),
+                    exist_ok=True)
+
+        with self._connect() as con:
+            for statement in _SCHEMA:
+                con.execute(statement)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        '''One transaction (committed or rolled back), the connection is closed afterwards'''
+        with closing(sqlite3.connect(self.index_path, timeout=60)) as con:
+            with con:
+                yield con
+
+    def _leaf_folders(self) -> Dict[str, int]:
+        '''Returns {relative leaf folder: mtime_ns} for the current state on disk'''
+        folders = {'': None}
+        for _ in self.folder_hierarchy:
+            subfolders = {}
+            for folder in folders:
+                try:
+                    entries = os.scandir(os.path.join(self.root_path, folder))
+                except FileNotFoundError:
+                    continue
+                with entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            subfolders[os.path.join(
+                                folder,
+                                entry.name)] = entry.stat().st_mtime_ns
+            folders = subfolders
+        return folders
+
+    def _scan_folder(self, folder: str) -> List[tuple]:
+        rows = []
+        folder_path = os.path.join(self.root_path, folder)
+        levels = dict(zip(self.folder_hierarchy, folder.split(os.sep)))
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not self.register_file_pattern.match(
+                        entry.name):
+                    continue
+                time, pol = parse_sgrt_keys(entry.name)
+                rows.append(
+                    (self.root_path, folder, entry.path,
+                     levels.get('tile_name', levels.get('tile')),
+                     levels.get('var_name', levels.get('quantity')), time,
+                     pol))
+        return rows
+
+    def refresh(self) -> Dict[str, int]:
+        '''Rescans all leaf folders whose mtime changed since the last refresh
+
+        Returns
+        -------
+
+        Dict[str, int]
+            Number of 'scanned', 'unchanged' and 'removed' folders
+        '''
+        on_disk = self._leaf_folders()
+        with self._connect() as con:
+            indexed = dict(
+                con.execute(
+                    'SELECT folder, mtime_ns FROM folders WHERE root = ?',
+                    (self.root_path, )))
+
+            removed = [folder for folder in indexed if folder not in on_disk]
+            changed = [
+                folder for folder, mtime_ns in on_disk.items()
+                if indexed.get(folder) != mtime_ns
+            ]
+
+            for folder in removed + changed:
+                con.execute('DELETE FROM files WHERE root = ? AND folder = ?',
+                            (self.root_path, folder))
+                con.execute(
+                    'DELETE FROM folders WHERE root = ? AND folder = ?',
+                    (self.root_path, folder))
+
+            for folder in changed:
+                con.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                self._scan_folder(folder))
+                con.execute('INSERT INTO folders VALUES (?, ?, ?)',
+                            (self.root_path, folder, on_disk[folder]))
+
+        return {
+            'scanned': len(changed),
+            'unchanged': len(on_disk) - len(changed),
+            'removed': len(removed)
+        }
+
+    def query(self,
+              tile_name: Optional[str] = None,
+              var_name: Optional[str] = None,
+              pol: Optional[str] = None,
+              start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> List[str]:
+        '''Returns the sorted filepaths matching all given keys (None = no filter)'''
+        clauses, params = ['root = ?'], [self.root_path]
+        for column, value in (('tile_name', tile_name),
+                              ('var_name', var_name), ('pol', pol)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if start is not None:
+            clauses.append('time >= ?')
+            params.append(start.isoformat())
+        if end is not None:
+            clauses.append('time <= ?')
+            params.append(end.isoformat())
+
+        with self._connect() as con:
+            return [
+                row[0] for row in con.execute(
+                    f'SELECT filepath FROM files WHERE {" AND ".join(clauses)} '
+                    'ORDER BY filepath', params)
+            ]
+
+    @property
+    def file_register(self) -> List[str]:
+        return self.query()
@@ -0,0 +1,244 @@
+import warnings
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from timeseries_by_geom import decode
+
+DAYS_PER_YEAR = 365.25
+
+
+def design_matrix(
+        times: np.ndarray,
+        n_harmonics: int = 2,
+        trend: bool = True,
+        period_days: float = DAYS_PER_YEAR) -> Tuple[np.ndarray, List[str]]:
+    '''Regressors of the harmonic model for every time step
+
+    y(t) = intercept + trend * t + sum_k (cos_k * cos(2 pi k t / P) + sin_k * sin(2 pi k t / P))
+
+    with t in years since January 1st of the first year, so the phases refer to the
+    calendar.
+
+    Parameters
+    ----------
+
+    times: np.ndarray
+        datetime64 time stamps
+    n_harmonics: int
+        Number of harmonics. Default: 2 (annual and semi-annual cycle)
+    trend: bool
+        Include a linear trend. Default: True
+    period_days: float
+        Period of the first harmonic [days]. Default: 365.25
+
+    Returns
+    -------
+
+    Tuple[np.ndarray, List[str]]
+        (n_time, n_params) design matrix and the parameter names
+    '''
+    times = pd.DatetimeIndex(times)
+    origin = pd.Timestamp(year=times.min().year, month=1, day=1)
+    days = np.asarray((times - origin) / pd.Timedelta(days=1), dtype=float)
+
+    columns, names = [np.ones_like(days)], ['intercept']
+    if trend:
+        columns.append(days / DAYS_PER_YEAR)
+        names.append('trend')
+    for k in range(1, n_harmonics + 1):
+        angle = 2 * np.pi * k * days / period_days
+        columns += [np.cos(angle), np.sin(angle)]
+        names += [f'cos_{k}', f'sin_{k}']
+    return np.column_stack(columns), names
+
+
+def fit_harmonics(
+        values: np.ndarray,
+        design: np.ndarray,
+        min_valid: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    '''Least-squares fit of the model `design` for all pixels at once, NaNs are gaps
+
+    The per-pixel normal equations (A^T W A) c = A^T W y, with W the 0/1 mask of the
+    valid values, are built with two matrix products and solved in one batched call.
+
+    Parameters
+    ----------
+
+    values: np.ndarray
+        (n_pixels, n_time) values
+    design: np.ndarray
+        (n_time, n_params) design matrix, see `design_matrix`
+    min_valid: Optional[int]
+        Minimum number of valid values of a pixel. Default: None (n_params + 1)
+
+    Returns
+    -------
+
+    Tuple[np.ndarray, np.ndarray]
+        (n_pixels, n_params) coefficients (NaN for pixels with too few values) and the
+        (n_pixels, ) root mean square residuals
+    '''
+    n_params = design.shape[1]
+    if min_valid is None:
+        min_valid = n_params + 1
+
+    weights = np.isfinite(values)
+    y = np.where(weights, values, 0.)
+    weights = weights.astype(float)
+
+    # W @ (A (x) A) gives the flattened A^T W A of every pixel
+    outer = (design[:, :, None] * design[:, None, :]).reshape(len(design), -1)
+    normal = (weights @ outer).reshape(-1, n_params, n_params)
+    rhs = y @ design
+
+    n_valid = weights.sum(axis=1)
+    solvable = n_valid >= min_valid
+    if solvable.any():
+        # e.g. all valid values within a few days, the harmonics are not determined
+        eigenvalues = np.linalg.eigvalsh(normal[solvable])
+        solvable[solvable] = eigenvalues[:, 0] > 1e-10 * eigenvalues[:, -1]
+    normal[~solvable] = np.eye(n_params)
+
+    coefficients = np.linalg.solve(normal, rhs[:, :, None])[:, :, 0]
+    coefficients[~solvable] = np.nan
+
+    residuals = (y - coefficients @ design.T) * weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rmse = np.sqrt((residuals**2).sum(axis=1) / n_valid)
+    rmse[~solvable] = np.nan
+    return coefficients, rmse
+
+
+def _pixel_features(values: np.ndarray, design: np.ndarray,
+                    names: List[str], percentiles: Sequence[float],
+                    n_harmonics: int, period_days: float) -> dict:
+    features = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN pixels
+        features['n_valid'] = np.isfinite(values).sum(axis=1)
+        features['mean'] = np.nanmean(values, axis=1)
+        features['std'] = np.nanstd(values, axis=1)
+        features['min'] = np.nanmin(values, axis=1)
+        features['max'] = np.nanmax(values, axis=1)
+        if len(percentiles):
+            quantiles = np.nanpercentile(values, percentiles, axis=1)
+            for q, quantile in zip(percentiles, quantiles):
+                features[f'p{q:g}'] = quantile
+
+    coefficients, features['rmse'] = fit_harmonics(values, design)
+    parameters = dict(zip(names, coefficients.T))
+    features['intercept'] = parameters['intercept']
+    if 'trend' in parameters:
+        features['trend'] = parameters['trend']
+    for k in range(1, n_harmonics + 1):
+        cos, sin = parameters[f'cos_{k}'], parameters[f'sin_{k}']
+        features[f'amplitude_{k}'] = np.hypot(cos, sin)
+        # day of the (first) maximum of the k-th harmonic within its period
+        features[f'phase_{k}'] = (np.arctan2(sin, cos) %
+                                  (2 * np.pi)) / (2 * np.pi) * period_days / k
+    return features
+
+
+def temporal_features(dataset: xr.Dataset,
+                      n_harmonics: int = 2,
+                      trend: bool = True,
+                      percentiles: Sequence[float] = (10, 50, 90),
+                      period_days: float = DAYS_PER_YEAR,
+                      chunk_size: int = 100000) -> xr.Dataset:
+    '''Per-pixel temporal statistics and harmonic model parameters
+
+    Works on the dense (x, y, time) or sparse (pixel, time) output of
+    `TimeSeriesByGeom.get_timeseries_xr` (and on the (time, y, x) output of
+    `masked_array`). Raw data is decoded first, NaNs (and masked pixels) are treated
+    as gaps. The pixels are processed in chunks of `chunk_size`, every chunk with one
+    batched least-squares solve.
+
+    Parameters
+    ----------
+
+    dataset: xr.Dataset
+        Dataset with a 'data' variable [dB] and a 'time' dimension
+    n_harmonics: int
+        Number of harmonics of the seasonal model. Default: 2
+    trend: bool
+        Fit a linear trend [dB / year]. Default: True
+    percentiles: Sequence[float]
+        Percentiles of the values. Default: (10, 50, 90)
+    period_days: float
+        Period of the first harmonic [days]. Default: 365.25
+    chunk_size: int
+        Number of pixels per chunk. Default: 100000
+
+    Returns
+    -------
+
+    xr.Dataset
+        One variable per feature with the spatial dimensions of `dataset`: 'n_valid',
+        'mean', 'std', 'min', 'max', 'p<q>', 'rmse', 'intercept', 'trend' and per
+        harmonic k 'amplitude_k' [dB] and 'phase_k' [day of the maximum]
+    '''
+    data = dataset['data']
+    if 'scale_factor' in data.attrs:
+        data = decode(data)
+    spatial_dims = [dim for dim in data.dims if dim != 'time']
+    data = data.transpose(*spatial_dims, 'time')
+
+    spatial_shape = data.shape[:-1]
+    values = np.asarray(data.data).reshape(-1, data.shape[-1])
+    if not len(values):
+        raise ValueError('The dataset contains no pixels')
+    design, names = design_matrix(data.time.values, n_harmonics, trend,
+                                  period_days)
+
+    chunks = []
+    for start in range(0, len(values), chunk_size):
+        chunks.append(
+            _pixel_features(values[start:start + chunk_size].astype(float),
+                            design, names, percentiles, n_harmonics,
+                            period_days))
+
+    features = {
+        name: np.concatenate([chunk[name]
+                              for chunk in chunks]).reshape(spatial_shape)
+        for name in chunks[0]
+    }
+    coords = {
+        name: coord
+        for name, coord in data.coords.items() if 'time' not in coord.dims
+    }
+    return xr.Dataset(
+        {name: (spatial_dims, feature)
+         for name, feature in features.items()},
+        coords=coords,
+        attrs={
+            'n_harmonics': n_harmonics,
+            'period_days': period_days,
+            'trend_unit': 'dB / year'
+        })
+
+
+def feature_table(features: xr.Dataset,
+                  forest_type: Optional[str] = None) -> pd.DataFrame:
+    '''Pixels with a valid model fit as rows, e.g. as training data of a classifier
+
+    Parameters
+    ----------
+
+    features: xr.Dataset
+        Output of `temporal_features`
+    forest_type: Optional[str]
+        Label added as column 'forest_type', e.g. `TestArea.forest_type`. Default: None
+
+    Returns
+    -------
+
+    pd.DataFrame
+    '''
+    table = features.to_dataframe()
+    table = table[np.isfinite(table['intercept'])]
+    if forest_type is not None:
+        table['forest_type'] = forest_type
+    return table
@@ -1,7 +1,15 @@
-from dataclasses import dataclass
+from dataclasses import InitVar, dataclass, field
 from typing import List
 from typing import Optional
+import numpy as np
+from shapely import wkb
 from shapely.geometry import shape, Polygon
+from shapely.prepared import prep, PreparedGeometry
+
+try:
+    from shapely import contains_xy
+except ImportError:  # shapely < 2.0
+    from shapely.vectorized import contains as contains_xy
 
 
 @dataclass
@@ -40,6 +48,11 @@ class TestAreaNils:
 class TestArea:  # Combination of Nils' and Nico's TestArea classes
     '''Class for storing test area information
 
+    The geometry is parsed once on construction and only the shapely polygon and its
+    exterior coordinates (as a NumPy array) are kept, the GeoJSON dict is dropped. The
+    coordinate tuples of `geom` are built on first access. Simplified versions for map
+    rendering are cached per tolerance, see `simplified`.
+
     Parameters
     ----------
 
@@ -56,25 +69,94 @@ class TestArea:  # Combination of Nils' and Nico's TestArea classes
     '''
     name: str
     forest_type: str
-    _geom: dict
+    _geom: InitVar[dict]
     info: Optional[str] = None
     _mask: Optional[Polygon] = None
+    _shape: Polygon = field(init=False, repr=False)
+    _coords: np.ndarray = field(init=False, repr=False, compare=False)
+    _geom_list: Optional[List[tuple]] = field(init=False,
+                                              repr=False,
+                                              compare=False)
+    _prepared: Optional[PreparedGeometry] = field(init=False,
+                                                  repr=False,
+                                                  compare=False)
+    _simplified: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self, _geom: dict):
+        self._parse(shape(_geom))
+
+    def _parse(self, polygon: Polygon):
+        self._shape = polygon
+        self._coords = np.asarray(polygon.exterior.coords, dtype=float)
+        self._coords.flags.writeable = False
+        self._geom_list = None
+        self._prepared = None
+        self._simplified = {}
+
+    def __getstate__(self):
+        # prepared geometries can't be pickled, the geometry travels as WKB
+        return (self.name, self.forest_type, self._shape.wkb, self.info,
+                self._mask)
+
+    def __setstate__(self, state):
+        self.name, self.forest_type, geometry, self.info, self._mask = state
+        self._parse(wkb.loads(geometry))
+
+    @property
+    def shape(self) -> Polygon:
+        return self._shape
+
+    @property
+    def prepared(self) -> PreparedGeometry:
+        '''Prepared geometry for fast repeated contains/intersects checks'''
+        if self._prepared is None:
+            self._prepared = prep(self._shape)
+        return self._prepared
+
+    @property
+    def coords(self) -> np.ndarray:
+        '''(n, 2) array of the exterior (x, y) coordinates (read-only)'''
+        return self._coords
 
     @property
-    def geom(self):
-        return [(x, y) for x, y in shape(self._geom).exterior.coords]
+    def bounds(self) -> tuple:
+        '''(min_x, min_y, max_x, max_y)'''
+        return self._shape.bounds
+
+    @property
+    def geom(self) -> List[tuple]:
+        '''Exterior coordinates as a list of (x, y) tuples, built once'''
+        if self._geom_list is None:
+            self._geom_list = list(map(tuple, self._coords.tolist()))
+        return self._geom_list
 
     @property
     def bbox(self):
-        return [
-            tuple(shape(self._geom).bounds[:2]),
-            tuple(shape(self._geom).bounds[2:])
-        ]
+        bounds = self._shape.bounds
+        return [bounds[:2], bounds[2:]]
 
     @property
     def mask(self):
-        if not self._mask:
+        if self._mask is None:
             return self.geom
+        return self._mask
+
+    def simplified(self, tolerance: float) -> Polygon:
+        '''Topology preserving simplification (tolerance in degrees), cached per tolerance'''
+        if tolerance <= 0:
+            return self._shape
+        simplified = self._simplified.get(tolerance)
+        if simplified is None:
+            simplified = self._shape.simplify(tolerance, preserve_topology=True)
+            self._simplified[tolerance] = simplified
+        return simplified
+
+    def contains(self, x, y) -> np.ndarray:
+        '''Vectorized point-in-polygon test for coordinate arrays `x`, `y`'''
+        return contains_xy(self._shape, x, y)
+
+    def intersects(self, other) -> bool:
+        return self.prepared.intersects(other)
 
 
 def coords_from_google_maps(mask):
@@ -1,20 +1,51 @@
 from typing_extensions import deprecated
-from geopathfinder.naming_conventions.sgrt_naming import SgrtFilename
 from yeoda.products.base import ProductDataCube
 from equi7grid.equi7grid import Equi7Grid
+import gdal
 import osr
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import warnings
 import os
 from geopathfinder.folder_naming import build_smarttree
 from datetime import datetime
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Tuple, Union
 import numpy as np
+import pandas as pd
 from tqdm import trange
 from shapely.geometry import Polygon
 import xarray as xr
 
+try:
+    from shapely import contains_xy
+except ImportError:  # shapely < 2.0
+    from shapely.vectorized import contains as contains_xy
+
 from testarea import TestArea
+from register_index import FileRegisterIndex
+from timeseries_store import TimeSeriesStore
+from mask_cache import PixelMaskCache
+from transforms import add_lonlat, transform_coords
+from instrumentation import count, stage
+from prefetch import DEFAULT_MAX_BYTES, PrefetchReader
+from products import ProductSpec, get_product, register_product
+
+
+# pandas period frequencies of `TimeSeriesByGeom.iter_temporal_slices`,
+# 'Q-NOV' quarters are the meteorological seasons DJF, MAM, JJA, SON
+PERIOD_FREQUENCIES = {'day': 'D', 'week': 'W-SUN', 'month': 'M', 'season': 'Q-NOV'}
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+
+def _period_label(time_period: pd.Period, period: str) -> str:
+    if period == 'day':
+        return f'{time_period.start_time:%Y-%m-%d}'
+    if period == 'week':
+        return f'{time_period.start_time:%G-W%V}'
+    if period == 'month':
+        return f'{time_period.start_time:%Y-%m}'
+    return f'{time_period.qyear}-{SEASONS[time_period.quarter - 1]}'
 
 
 @dataclass
@@ -35,18 +66,213 @@ class TemporalWindow:
         return self.start <= item <= self.end
 
 
+class RawProductDataCube(ProductDataCube):
+    """
+    ProductDataCube that hands out the stored integers (e.g. int16) without applying
+    the scale factor or the nodata value. Use `decode` to get physical values.
+    """
+
+    def decode(self, data, **kwargs):
+        return data
+
+
+def decode(data: xr.DataArray, dtype: np.dtype = np.float32) -> xr.DataArray:
+    """
+    Applies the 'scale_factor', 'add_offset' and '_FillValue' attributes of raw data.
+
+    Parameters
+    ----------
+
+    data: xr.DataArray
+        Raw (integer) data as returned in `storage='raw'` mode
+    dtype: np.dtype
+        Float type of the decoded data. Default: np.float32
+
+    Returns
+    -------
+
+    xr.DataArray
+        Physical values, nodata set to NaN
+    """
+    attrs = dict(data.attrs)
+    scale_factor = attrs.pop('scale_factor', 1)
+    add_offset = attrs.pop('add_offset', 0)
+    nodata = attrs.pop('_FillValue', None)
+
+    decoded = data.astype(dtype) * np.asarray(scale_factor, dtype=dtype)
+    if add_offset:
+        decoded = decoded + np.asarray(add_offset, dtype=dtype)
+    if nodata is not None:
+        decoded = decoded.where(data != nodata)
+    decoded.attrs = attrs
+    return decoded
+
+
+def decode_timeseries(dataset: xr.Dataset,
+                      dtype: np.dtype = np.float32) -> xr.Dataset:
+    """
+    Decodes every variable of `dataset` that carries a 'scale_factor' attribute.
+    """
+    return dataset.assign({
+        name: decode(variable, dtype=dtype)
+        for name, variable in dataset.data_vars.items()
+        if 'scale_factor' in variable.attrs
+    })
+
+
+def build_datacube(filepaths: List[str],
+                   resolution: int,
+                   dimensions: List[str],
+                   scale_factor: Optional[int],
+                   nodata: Optional[int],
+                   storage: str = 'decoded',
+                   product: str = 'sig0') -> ProductDataCube:
+    """
+    Builds the datacube of `filepaths` of a registered product (see products.py), with
+    the tile and time dimensions renamed to 'tile' and 'time'. Only takes picklable
+    arguments, so worker processes can rebuild a part of the datacube themselves.
+    """
+    spec = get_product(product)
+    datacube_class = spec.datacube_class
+    kwargs = dict(spec.datacube_kwargs)
+    if issubclass(datacube_class, ProductDataCube):
+        if storage == 'raw':
+            datacube_class = RawProductDataCube
+        kwargs.update(scale_factor=scale_factor, nodata=nodata)
+
+    with stage('cube_construction', product=spec.name):
+        count(files=len(filepaths))
+        _datacube = datacube_class(filepaths=filepaths,
+                                   dimensions=dimensions,
+                                   filename_class=spec.filename_class,
+                                   grid=Equi7Grid(resolution).EU,
+                                   **kwargs)
+        renames = {spec.tile_dimension: 'tile'}
+        if spec.time_dimension not in (None, 'time'):
+            renames[spec.time_dimension] = 'time'
+        _datacube.rename_dimensions(renames, inplace=True)
+    return _datacube
+
+
+def _count_loaded(n_files: int, data, product: str) -> None:
+    """
+    Adds a window load to the profiler counters of the current stage, the bytes as
+    stored in the archive (dtype of the product)
+    """
+    count(files=n_files,
+          bytes_read=data.size * get_product(product).itemsize,
+          pixels=data.size)
+
+
+def _load_part(filepaths: List[str], cube_kwargs: dict, polygon, sref_wkt: str,
+               apply_mask: bool) -> xr.Dataset:
+    """
+    Worker of the parallel `masked_array`: loads `polygon` from a part of the datacube.
+    """
+    sref = osr.SpatialReference()
+    sref.ImportFromWkt(sref_wkt)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        part = build_datacube(filepaths, **cube_kwargs)
+        with stage('geotiff_read'):
+            loaded = part.load_by_geom(polygon,
+                                       sref=sref,
+                                       apply_mask=apply_mask,
+                                       dtype='xarray').rename({'1': 'data'})
+            _count_loaded(len(filepaths), loaded['data'],
+                          cube_kwargs['product'])
+        return loaded
+
+
+def _load_block_values(filepaths: List[str], cube_kwargs: dict, bbox: list,
+                       sref_wkt: str, shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Worker of the lazy `masked_array`: the (time, y, x) values of one spatial block.
+    """
+    values = _load_part(filepaths, cube_kwargs, bbox, sref_wkt,
+                        False).sortby('time')['data'].values
+    if values.shape[1:] != shape:
+        raise ValueError(f'Expected a {shape} block, yeoda loaded '
+                         f'{values.shape[1:]} pixels for {bbox}')
+    return values
+
+
+def _block_slices(n_pixels: int, offset: int, size: int) -> List[slice]:
+    """
+    Cuts a window of `n_pixels` that starts at pixel `offset` of the file at the
+    multiples of `size` pixels of the file.
+    """
+    edges = [0, *range(size - offset % size, n_pixels, size), n_pixels]
+    return [slice(start, stop) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def _file_blocks(filepath: str,
+                 x_values: np.ndarray,
+                 y_values: np.ndarray,
+                 min_size: int = 512) -> Tuple[List[slice], List[slice]]:
+    """
+    Row and column slices of a window of `filepath` (pixel centres `x_values`,
+    `y_values`) along the GeoTIFF block layout, blocks merged to at least `min_size`.
+    """
+    dataset = gdal.Open(filepath)
+    block_cols, block_rows = dataset.GetRasterBand(1).GetBlockSize()
+    ulx, x_res, _, uly, _, y_res = dataset.GetGeoTransform()
+    col_offset = int(round((x_values[0] - ulx) / x_res - 0.5))
+    row_offset = int(round((y_values[0] - uly) / y_res - 0.5))
+    rows = block_rows * max(1, -(-min_size // block_rows))
+    cols = block_cols * max(1, -(-min_size // block_cols))
+    return (_block_slices(len(y_values), row_offset, rows),
+            _block_slices(len(x_values), col_offset, cols))
+
+
+def _combine_tiles(tile_arrays: List[xr.Dataset],
+                   fill_value: float = np.nan) -> xr.Dataset:
+    """
+    Stitches the (time, y, x) windows of adjacent tiles into one dataset.
+
+    Tiles can have different acquisition times (e.g. at swath edges), so they are
+    aligned on the union of their times first, missing dates filled with `fill_value`.
+    """
+    if len(tile_arrays) == 1:
+        return tile_arrays[0]
+    tile_arrays = xr.align(*tile_arrays,
+                           join='outer',
+                           exclude=('x', 'y'),
+                           fill_value=fill_value)
+    return xr.combine_by_coords(tile_arrays, combine_attrs='override')
+
+
 class DataCubeLoader:
 
     def __init__(self,
                  resolution: int = 10,
                  lonlatsys: int = 4326,
-                 dimensions: List[str] = [
-                     "time", "var_name", "tile_name", "pol"
-                 ],
-                 scale_factor: int = 100) -> None:
+                 dimensions: Optional[List[str]] = None,
+                 scale_factor: Optional[int] = None,
+                 use_index: bool = True,
+                 index_path: Optional[str] = None,
+                 nodata: Optional[int] = None,
+                 storage: str = 'decoded',
+                 mask_cache: Optional[PixelMaskCache] = None,
+                 root_path: Optional[str] = None,
+                 product: Union[str, ProductSpec] = 'sig0') -> None:
+        """
+        Loader of one archive product, 'sig0' by default (see products.py).
+
+        `dimensions`, `scale_factor`, `nodata` and `root_path` default to the settings
+        of the product, e.g. ["time", "var_name", "tile_name", "pol"], 100, -9999 and
+        `.../sentinel1/preprocessed/EU<resolution>M` for 'sig0'.
+        """
 
-        self.USER = os.getcwd().split('/')[
-            2]  #This command should automatically get your username
+        if storage not in ('decoded', 'raw'):
+            raise ValueError(
+                f"storage must be 'decoded' or 'raw', not '{storage}'")
+        if isinstance(product, ProductSpec):
+            register_product(product)  # workers look it up by name
+        self.product = get_product(product)
+        if storage == 'raw' and self.product.scale_factor is None:
+            raise ValueError(
+                f"storage='raw' needs a scaled product, {self.product.name} is not")
 
         self.sref = osr.SpatialReference()
         self.lonlatsys = lonlatsys
@@ -56,25 +282,181 @@ class DataCubeLoader:
         self.resolution = resolution
         self.subgrid = Equi7Grid(self.resolution).EU
 
-        self.root_path = f"/home/{self.USER}/shared/datasets/fe/data/sentinel1/preprocessed/EU{self.resolution:03}M"
-        self.folder_hierarchy = ["tile_name", "var_name"]
-
-        self.tree = build_smarttree(self.root_path,
-                                    self.folder_hierarchy,
-                                    register_file_pattern="^[^Q].*.tif$")
-        self.dimensions = dimensions
+        # CRS definitions of the cached, vectorized transforms (see transforms.py)
+        self.lonlat_crs = f'EPSG:{self.lonlatsys}'
+        self.projection_crs = self.subgrid.core.projection.wkt
+        self.projection_sref = osr.SpatialReference()
+        self.projection_sref.ImportFromWkt(self.projection_crs)
+
+        self.USER = None  # only needed for the shared datasets
+        if root_path is None:  # e.g. a local (synthetic) archive instead of the shared one
+            self.USER = os.getcwd().split('/')[
+                2]  #This command should automatically get your username
+            root_path = self.product.root_path(self.resolution)
+        self.root_path = root_path
+        self.folder_hierarchy = list(self.product.folder_hierarchy)
+
+        if use_index:
+            # incremental on-disk index, only rescans tile folders that changed
+            self.tree = None
+            with stage('index_refresh'):
+                self.index = FileRegisterIndex(
+                    self.root_path,
+                    self.folder_hierarchy,
+                    register_file_pattern="^[^Q].*.tif$",
+                    index_path=index_path)
+                self.index.refresh()
+                self.file_register = self.index.file_register
+                count(files=len(self.file_register))
+        else:
+            self.index = None
+            with stage('tree_scan'):
+                self.tree = build_smarttree(
+                    self.root_path,
+                    self.folder_hierarchy,
+                    register_file_pattern="^[^Q].*.tif$")
+                self.file_register = self.tree.file_register
+                count(files=len(self.file_register))
+        self.dimensions = list(dimensions or self.product.dimensions)
+        if scale_factor is None:
+            scale_factor = self.product.scale_factor
         self.scale_factor = scale_factor  # with yeoda v0.3.0, the scale factor still needs to be defined by the user
+        self.nodata = self.product.nodata if nodata is None else nodata
+        self.storage = storage  # 'raw' keeps the stored int16 values, see `decode`
+
+        if mask_cache is None:
+            mask_cache = PixelMaskCache()
+        self.mask_cache = mask_cache  # rasterized test area masks per tile
+
+        self._datacube = None
+        self._datacube_lock = threading.Lock()
 
     @property
-    def datacube(self):
-        _datacube = ProductDataCube(filepaths=self.tree.file_register,
-                                    dimensions=self.dimensions,
-                                    filename_class=SgrtFilename,
-                                    grid=self.subgrid,
-                                    scale_factor=self.scale_factor)
+    def datacube(self) -> ProductDataCube:
+        """
+        The ProductDataCube of the whole file register. It is built on first access and
+        then shared, so treat it as read-only (don't filter it with `inplace=True`).
+        """
+        with self._datacube_lock:
+            if self._datacube is None:
+                self._datacube = build_datacube(self.file_register,
+                                                **self.cube_kwargs)
+            return self._datacube
 
-        _datacube.rename_dimensions({'tile_name': 'tile'}, inplace=True)
-        return _datacube
+    @property
+    def cube_kwargs(self) -> dict:
+        """
+        Arguments of `build_datacube` (besides the filepaths) for this loader
+        """
+        return {
+            'resolution': self.resolution,
+            'dimensions': self.dimensions,
+            'scale_factor': self.scale_factor,
+            'nodata': self.nodata,
+            'storage': self.storage,
+            'product': self.product.name
+        }
+
+    def invalidate_datacube(self, refresh_register: bool = True) -> None:
+        """
+        Drops the cached datacube, e.g. after new acquisitions were added to the archive.
+
+        Parameters
+        ----------
+
+        refresh_register: bool
+            Re-read the file register (index refresh or tree walk) as well. Default: True
+        """
+        with self._datacube_lock:
+            if refresh_register:
+                if self.index is not None:
+                    with stage('index_refresh'):
+                        self.index.refresh()
+                        self.file_register = self.index.file_register
+                        count(files=len(self.file_register))
+                else:
+                    with stage('tree_scan'):
+                        self.tree = build_smarttree(
+                            self.root_path,
+                            self.folder_hierarchy,
+                            register_file_pattern="^[^Q].*.tif$")
+                        self.file_register = self.tree.file_register
+                        count(files=len(self.file_register))
+            self._datacube = None
+
+    def project(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Transforms an (n, 2) array of lon/lat coordinates to the Equi7 projection.
+        """
+        x, y = transform_coords(coords[:, 0], coords[:, 1], self.lonlat_crs,
+                                self.projection_crs)
+        return np.column_stack([x, y])
+
+    def pixel_mask(self, testarea: TestArea, tiles: List[str],
+                   x_values: np.ndarray, y_values: np.ndarray) -> np.ndarray:
+        """
+        Boolean (y, x) mask of the pixel centres inside `testarea`, from the mask cache.
+
+        Parameters
+        ----------
+
+        testarea: TestArea
+            The test area
+        tiles: List[str]
+            Equi7 tile name(s) the window was loaded from
+        x_values, y_values: np.ndarray
+            Projected pixel coordinates of the window
+
+        Returns
+        -------
+
+        np.ndarray
+        """
+
+        def rasterize():
+            projected = Polygon(self.project(testarea.coords))
+            xx, yy = np.meshgrid(x_values, y_values)
+            return contains_xy(projected, xx, yy)
+
+        with stage('pixel_mask'):
+            count(pixels=len(x_values) * len(y_values))
+            return self.mask_cache.get_or_create(testarea,
+                                                 '+'.join(sorted(tiles)),
+                                                 self.resolution, x_values,
+                                                 y_values, rasterize)
+
+    def apply_pixel_mask(self, dataset: xr.Dataset,
+                         mask: np.ndarray) -> xr.Dataset:
+        """
+        Sets 'data' outside of `mask` to NaN, or to the nodata value for raw data
+        """
+        mask = xr.DataArray(mask, dims=('y', 'x'))
+        attrs = dict(dataset['data'].attrs)
+        dataset = dataset.copy()
+        if self.storage == 'raw':
+            dataset['data'] = dataset['data'].where(mask, self.nodata)
+        else:
+            dataset['data'] = dataset['data'].where(mask)
+        dataset['data'].attrs = attrs
+        return dataset
+
+    @property
+    def fill_value(self) -> float:
+        """
+        Value of missing pixels: the nodata value for raw data, NaN otherwise
+        """
+        return self.nodata if self.storage == 'raw' else np.nan
+
+    @property
+    def encoding_attrs(self) -> Dict[str, float]:
+        """
+        CF attributes describing raw values: physical = raw * scale_factor + add_offset
+        """
+        return {
+            'scale_factor': 1 / self.scale_factor,
+            'add_offset': 0.0,
+            '_FillValue': self.nodata
+        }
 
 
 # class TimeSeriesByGeom():
@@ -224,16 +606,122 @@ class DataCubeLoader:
 #         return combined_dataset
 
 
-class TimeSeriesByGeom(DataCubeLoader):
+def _delegated(name: str) -> property:
+    """
+    Read-only property forwarding to the attribute `name` of the loader
+    """
+    return property(lambda self: getattr(self.loader, name))
+
+
+class TimeSeriesByGeom:
+    """
+    Loads the data of one test area with the settings and datacube of a DataCubeLoader.
+
+    The loader's state (sref, grid, file register, datacube) is not copied but read from
+    `loader` at every access, so all instances share it and see the state after
+    `invalidate_datacube`.
+    """
 
-    def __init__(self, testarea: TestArea,
-                 loaded_datacube: DataCubeLoader) -> None:
-        super().__init__()
+    def __init__(self,
+                 testarea: TestArea,
+                 loaded_datacube: Optional[DataCubeLoader] = None) -> None:
+        if loaded_datacube is None:
+            loaded_datacube = DataCubeLoader()
+        self.loader = loaded_datacube
         self.testarea = testarea
-        # self.datacube = loaded_datacube.datacube
-        # self.sref = self.datacube.sref  # Inherits sref from DataCubeLoader
+        self._projected = None
+
+    datacube = _delegated('datacube')
+    file_register = _delegated('file_register')
+    product = _delegated('product')
+    resolution = _delegated('resolution')
+    dimensions = _delegated('dimensions')
+    scale_factor = _delegated('scale_factor')
+    nodata = _delegated('nodata')
+    storage = _delegated('storage')
+    sref = _delegated('sref')
+    lonlat_crs = _delegated('lonlat_crs')
+    projection_crs = _delegated('projection_crs')
+    projection_sref = _delegated('projection_sref')
+    mask_cache = _delegated('mask_cache')
+    cube_kwargs = _delegated('cube_kwargs')
+    fill_value = _delegated('fill_value')
+    encoding_attrs = _delegated('encoding_attrs')
+
+    def invalidate_datacube(self, refresh_register: bool = True) -> None:
+        self.loader.invalidate_datacube(refresh_register=refresh_register)
+
+    def project(self, coords: np.ndarray) -> np.ndarray:
+        return self.loader.project(coords)
+
+    def pixel_mask(self, testarea: TestArea, tiles: List[str],
+                   x_values: np.ndarray, y_values: np.ndarray) -> np.ndarray:
+        return self.loader.pixel_mask(testarea, tiles, x_values, y_values)
+
+    def apply_pixel_mask(self, dataset: xr.Dataset,
+                         mask: np.ndarray) -> xr.Dataset:
+        return self.loader.apply_pixel_mask(dataset, mask)
+
+    def iter_temporal_slices(
+        self,
+        temporal_slice: TemporalWindow,
+        period: str = 'month',
+        custom_windows: Optional[List[TemporalWindow]] = None,
+        datacube: Optional[ProductDataCube] = None
+    ) -> Iterator[Tuple[str, ProductDataCube]]:
+        """
+        Lazily yields (label, sub-datacube) pairs of one period each within a time range.
+
+        Only periods that contain acquisitions are yielded and the labels are derived from
+        their timestamps, e.g. '2017-03' (month), '2017-W09' (ISO week), '2018-DJF' (season,
+        December counts to the following year) or '2017-03-01' (day).
+
+        Parameters
+        ----------
+
+        temporal_slice: TemporalWindow
+            The temporal window to slice out of the datacube (end excluded)
+        period: str
+            'day', 'week', 'month', 'season' or 'custom'. Default: 'month'
+        custom_windows: Optional[List[TemporalWindow]]
+            Windows used with period='custom'. Default: None (the whole `temporal_slice`)
+        datacube: Optional[ProductDataCube]
+            The datacube to be sliced. Default: None (`self.datacube`)
+
+        Yields
+        ------
+
+        Tuple[str, ProductDataCube]
+        """
+        if period not in (*PERIOD_FREQUENCIES, 'custom'):
+            raise ValueError(
+                f"period must be one of {[*PERIOD_FREQUENCIES, 'custom']}, not '{period}'"
+            )
+        if datacube is None:
+            datacube = self.datacube
+
+        window_cube = datacube.filter_by_dimension(
+            [(temporal_slice.start, temporal_slice.end)], [('>=', '<')],
+            name='time')
+
+        if period == 'custom':
+            for window in custom_windows or [temporal_slice]:
+                yield (f'{window.start:%Y-%m-%d}_{window.end:%Y-%m-%d}',
+                       window_cube.filter_by_dimension(
+                           [(window.start, window.end)], [('>=', '<')],
+                           name='time'))
+            return
+
+        times = pd.DatetimeIndex(window_cube.inventory['time'])
+        for time_period in sorted(
+                times.to_period(PERIOD_FREQUENCIES[period]).unique()):
+            yield (_period_label(time_period, period),
+                   window_cube.filter_by_dimension(
+                       [(time_period.start_time.to_pydatetime(),
+                         (time_period + 1).start_time.to_pydatetime())],
+                       [('>=', '<')],
+                       name='time'))
 
-    @deprecated('not yet fully operational')
     def temporal_slicer(self,
                         temporal_slice: TemporalWindow,
                         split_monthly=True) -> Dict[str, ProductDataCube]:
@@ -243,40 +731,23 @@ class TimeSeriesByGeom(DataCubeLoader):
         Parameters
         ----------
 
-        datacube: ProductDataCube
-            The datacube to be sliced
         temporal_slice: TemporalWindow
             The temporal window to slice out of the datacube
+        split_monthly: bool
+            Split into monthly sub-datacubes labeled 'YYYY-MM'. Default: True
 
         Returns
         -------
 
         Dict[str, ProductDataCube]
         """
-        datacube = self.datacube
-
         if split_monthly:
-            months = [
-                'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
-                'Oct', 'Nov', 'Dec'
-            ]
-            return {
-                month: monthly_cube
-                for month, monthly_cube in zip(
-                    months,
-                    datacube.filter_by_dimension([(
-                        temporal_slice.start, temporal_slice.end)], [('>=',
-                                                                      '<')],
-                                                 name='time').split_monthly())
-            }
+            return dict(
+                self.iter_temporal_slices(temporal_slice, period='month'))
         else:
-            return {
-                'custom':
-                datacube.filter_by_dimension(
-                    [(temporal_slice.start, temporal_slice.end)],
-                    [('>=', '<')],
-                    name='time')
-            }
+            _, datacube = next(
+                self.iter_temporal_slices(temporal_slice, period='custom'))
+            return {'custom': datacube}
 
     @deprecated('not yet fully operational')
     def spatial_slicer(self, datacube: ProductDataCube,
@@ -309,28 +780,309 @@ class TimeSeriesByGeom(DataCubeLoader):
                                                    apply_mask=False,
                                                    dtype="numpy")
 
+    def _polygon(self):
+        if isinstance(self.testarea.mask, Polygon):
+            return self.testarea.mask.exterior.coords.xy
+        elif isinstance(self.testarea.mask, list):
+            return self.testarea.mask
+
+    def _projected_polygon(self) -> List[tuple]:
+        """
+        Exterior of the test area in the Equi7 projection (`projection_sref`).
+
+        Projected once per instance, so yeoda doesn't reproject the geometry for every load.
+        """
+        if self._projected is None:
+            mask = self.testarea.mask
+            coords = (np.asarray(mask.exterior.coords) if isinstance(
+                mask, Polygon) else self.testarea.coords)
+            self._projected = list(map(tuple, self.project(coords).tolist()))
+        return self._projected
+
+    def _load_geometry(self) -> Tuple[List[tuple], str]:
+        """
+        (projected polygon, projection WKT) for the loading workers, which can't share OSR objects
+        """
+        return self._projected_polygon(), self.projection_crs
+
+    def filter_spatially(self, datacube: ProductDataCube) -> ProductDataCube:
+        """
+        Restricts `datacube` to the tiles intersecting the projected bounds of the test area
+        """
+        projected = np.asarray(self._projected_polygon())
+        with warnings.catch_warnings(), stage('geometry_filter'):
+            warnings.simplefilter("ignore")
+            return datacube.filter_spatially_by_geom(
+                [tuple(projected.min(axis=0)),
+                 tuple(projected.max(axis=0))],
+                sref=self.projection_sref)
+
     def masked_array(self,
                      datacube: ProductDataCube,
                      apply_mask: Optional[bool] = False,
-                     dtype: str = 'xarray') -> np.ndarray:
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            # masked_xarray = jan_vv.load_by_geom(polygon,
-            #                                     sref=sref,
-            #                                     apply_mask=False,
-            #                                     dtype="numpy")
+                     dtype: str = 'xarray',
+                     n_workers: int = 1,
+                     time_chunks: int = 1,
+                     executor: str = 'thread',
+                     lazy: bool = False,
+                     files_per_chunk: int = 1,
+                     prefetch: int = 0,
+                     max_prefetch_bytes: Optional[int] = DEFAULT_MAX_BYTES
+                     ) -> np.ndarray:
+        """
+        Loads the data of the test area from `datacube`.
 
-            if isinstance(self.testarea.mask, Polygon):
-                polygon = self.testarea.mask.exterior.coords.xy
-            elif isinstance(self.testarea.mask, list):
-                polygon = self.testarea.mask
+        With `n_workers > 1` or `time_chunks > 1` the files are split per Equi7 tile and
+        into `time_chunks` time ranges per tile, loaded in a thread or process pool and
+        merged into the same (time, y, x) dataset as a serial load.
 
-            _masked_xarray = datacube.load_by_geom(polygon,
-                                                   sref=self.sref,
-                                                   apply_mask=apply_mask,
-                                                   dtype=dtype)
+        Parameters
+        ----------
+
+        datacube: ProductDataCube
+            The (filtered) datacube to load from
+        apply_mask: Optional[bool]
+            Mask pixels outside of the test area. Default: False
+        dtype: str
+            'xarray' or 'numpy' (serial loads only, a masked array with `apply_mask`).
+            Default: 'xarray'
+        n_workers: int
+            Number of parallel workers. Default: 1
+        time_chunks: int
+            Number of time ranges the files of every tile are split into. Default: 1
+        executor: str
+            'thread' or 'process'. Default: 'thread'
+        lazy: bool
+            Return a dask-backed dataset that only reads files when values are computed
+            (slicing, reductions and `to_netcdf` stream through memory). Spatially, the
+            chunks follow the GeoTIFF block layout and every chunk only reads its block.
+            Needs one file per tile and date. Default: False
+        files_per_chunk: int
+            Number of files (dates) per dask chunk in lazy mode. Default: 1
+        prefetch: int
+            Read the files one by one and up to `prefetch` files ahead in background
+            threads, while the current window is masked. Default: 0 (off)
+        max_prefetch_bytes: Optional[int]
+            Memory cap of the prefetched windows. Default: 512 MiB
+
+        Returns
+        -------
+
+        xr.Dataset
+            (time, y, x) dataset with variable 'data'
+        """
+        with stage('masked_array', testarea=self.testarea.name):
+            return self._masked_array(datacube, apply_mask, dtype, n_workers,
+                                      time_chunks, executor, lazy,
+                                      files_per_chunk, prefetch,
+                                      max_prefetch_bytes)
+
+    def _masked_array(self, datacube: ProductDataCube, apply_mask: bool,
+                      dtype: str, n_workers: int, time_chunks: int,
+                      executor: str, lazy: bool, files_per_chunk: int,
+                      prefetch: int,
+                      max_prefetch_bytes: Optional[int]) -> xr.Dataset:
+        # The polygon mask is not rasterized by yeoda for every load, it comes
+        # from the per-tile mask cache and is applied to the loaded window.
+        # Only the tiles of the test area are read and key the mask cache.
+        datacube = self.filter_spatially(datacube)
+        if lazy:
+            _masked_xarray = self._lazy_masked_array(
+                datacube, dtype=dtype, files_per_chunk=files_per_chunk)
+        elif prefetch > 0:
+            _masked_xarray = self._prefetched_masked_array(
+                datacube,
+                dtype=dtype,
+                apply_mask=apply_mask,
+                prefetch=prefetch,
+                max_bytes=max_prefetch_bytes)
+            apply_mask = False  # every window was masked on arrival
+        elif n_workers > 1 or time_chunks > 1:
+            _masked_xarray = self._parallel_masked_array(
+                datacube,
+                dtype=dtype,
+                n_workers=n_workers,
+                time_chunks=time_chunks,
+                executor=executor)
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                # masked_xarray = jan_vv.load_by_geom(polygon,
+                #                                     sref=sref,
+                #                                     apply_mask=False,
+                #                                     dtype="numpy")
+
+                polygon = self._projected_polygon()
+                # masking needs the window coordinates, masked numpy output is
+                # converted from the xarray output below
+                load_dtype = 'xarray' if apply_mask else dtype
+
+                with stage('geotiff_read'):
+                    _masked_xarray = datacube.load_by_geom(
+                        polygon,
+                        sref=self.projection_sref,
+                        apply_mask=False,
+                        dtype=load_dtype)
+                    if load_dtype == 'xarray':
+                        _count_loaded(len(datacube.inventory),
+                                      _masked_xarray['1'], self.product.name)
+            if load_dtype != 'xarray':
+                return _masked_xarray
             _masked_xarray = _masked_xarray.rename({'1': 'data'})
-            return _masked_xarray
+
+        tiles = sorted(datacube.inventory['tile'].unique())
+        _masked_xarray.attrs['tiles'] = ','.join(tiles)
+        if apply_mask:
+            mask = self.pixel_mask(self.testarea, tiles,
+                                   _masked_xarray.x.values,
+                                   _masked_xarray.y.values)
+            if dtype != 'xarray':
+                # (time, y, x) masked array as returned by yeoda with apply_mask
+                values = _masked_xarray['data'].transpose('time', 'y',
+                                                          'x').values
+                return np.ma.masked_array(values,
+                                          mask=np.broadcast_to(
+                                              ~mask, values.shape))
+            _masked_xarray = self.apply_pixel_mask(_masked_xarray, mask)
+        if self.storage == 'raw':
+            # raw values stay raw, the attributes allow decoding later on
+            _masked_xarray['data'].attrs.update(self.encoding_attrs)
+        return _masked_xarray
+
+    def _lazy_masked_array(self, datacube: ProductDataCube, dtype: str,
+                           files_per_chunk: int) -> xr.Dataset:
+        import dask
+        import dask.array as da
+
+        if dtype != 'xarray':
+            raise ValueError("Lazy loading only supports dtype='xarray'")
+
+        polygon, sref_wkt = self._load_geometry()
+        inventory = datacube.inventory.sort_values(['tile', 'time'])
+        if inventory.duplicated(['tile', 'time']).any():
+            # every file is one time step of the dask array
+            raise ValueError(
+                'Lazy loading needs one file per tile and date, filter the datacube '
+                'to one variable and polarisation first')
+        quarter_pixel = self.resolution / 4
+        tile_arrays = []
+        for tile in inventory['tile'].unique():
+            tile_inventory = inventory[inventory['tile'] == tile]
+            filepaths = list(tile_inventory['filepath'])
+
+            # one eager single-file load provides the window coordinates and dtype
+            template = _load_part(filepaths[:1], self.cube_kwargs, polygon,
+                                  sref_wkt, False)['data']
+            x_values, y_values = template.x.values, template.y.values
+            row_slices, col_slices = _file_blocks(filepaths[0], x_values,
+                                                  y_values)
+
+            # every chunk reads its own block: a bbox from a quarter pixel inside the
+            # corner pixels, so yeoda's window matches the block exactly
+            blocks = []
+            for start in range(0, len(filepaths), files_per_chunk):
+                part = filepaths[start:start + files_per_chunk]
+                rows = []
+                for row_slice in row_slices:
+                    block_y = y_values[row_slice]
+                    columns = []
+                    for col_slice in col_slices:
+                        block_x = x_values[col_slice]
+                        bbox = [(block_x.min() - quarter_pixel,
+                                 block_y.min() - quarter_pixel),
+                                (block_x.max() + quarter_pixel,
+                                 block_y.max() + quarter_pixel)]
+                        shape = (len(block_y), len(block_x))
+                        values = dask.delayed(_load_block_values)(
+                            part, self.cube_kwargs, bbox, sref_wkt, shape)
+                        columns.append(
+                            da.from_delayed(values,
+                                            shape=(len(part), *shape),
+                                            dtype=template.dtype))
+                    rows.append(columns)
+                blocks.append(rows)
+            data = da.block(blocks)
+
+            tile_arrays.append(
+                xr.Dataset({'data': (('time', 'y', 'x'), data)},
+                           coords={
+                               'time': tile_inventory['time'].values,
+                               'y': y_values,
+                               'x': x_values
+                           }))
+
+        return _combine_tiles(tile_arrays, self.fill_value)
+
+    def _prefetched_masked_array(self, datacube: ProductDataCube, dtype: str,
+                                 apply_mask: bool, prefetch: int,
+                                 max_bytes: Optional[int]) -> xr.Dataset:
+        if dtype != 'xarray':
+            raise ValueError("Prefetched loading only supports dtype='xarray'")
+
+        polygon, sref_wkt = self._load_geometry()
+        reader = PrefetchReader(
+            lambda filepath: _load_part([filepath], self.cube_kwargs, polygon,
+                                        sref_wkt, False),
+            queue_depth=prefetch,
+            n_workers=min(prefetch, 4),
+            max_bytes=max_bytes)
+
+        inventory = datacube.inventory.sort_values(['tile', 'time'])
+        tile_arrays = []
+        for tile in inventory['tile'].unique():
+            filepaths = inventory.loc[inventory['tile'] == tile, 'filepath']
+            mask, windows = None, []
+            for _, window in reader.iter(filepaths):
+                if apply_mask:
+                    if mask is None:
+                        mask = self.pixel_mask(self.testarea, [tile],
+                                               window.x.values,
+                                               window.y.values)
+                    window = self.apply_pixel_mask(window, mask)
+                windows.append(window)
+            tile_arrays.append(xr.concat(windows, dim='time').sortby('time'))
+
+        return _combine_tiles(tile_arrays, self.fill_value)
+
+    def _parallel_masked_array(self, datacube: ProductDataCube, dtype: str,
+                               n_workers: int, time_chunks: int,
+                               executor: str) -> xr.Dataset:
+        if dtype != 'xarray':
+            raise ValueError("Parallel loading only supports dtype='xarray'")
+        if executor not in ('thread', 'process'):
+            raise ValueError(
+                f"executor must be 'thread' or 'process', not '{executor}'")
+
+        inventory = datacube.inventory
+        parts = []  # (tile, filepaths), sorted by tile and time
+        for tile in sorted(inventory['tile'].unique()):
+            tile_inventory = inventory[inventory['tile'] == tile]
+            times = np.sort(tile_inventory['time'].unique())
+            for chunk in np.array_split(times, min(time_chunks, len(times))):
+                in_chunk = tile_inventory['time'].isin(chunk)
+                parts.append(
+                    (tile,
+                     sorted(tile_inventory.loc[in_chunk, 'filepath'])))
+
+        pool_class = (ProcessPoolExecutor
+                      if executor == 'process' else ThreadPoolExecutor)
+        polygon, sref_wkt = self._load_geometry()
+        with pool_class(max_workers=n_workers) as pool:
+            futures = [
+                pool.submit(_load_part, filepaths, self.cube_kwargs, polygon,
+                            sref_wkt, False) for _, filepaths in parts
+            ]
+            loaded = [future.result() for future in futures]
+
+        # concatenate the time chunks per tile, then merge the tiles spatially
+        per_tile: Dict[str, List[xr.Dataset]] = {}
+        for (tile, _), part in zip(parts, loaded):
+            per_tile.setdefault(tile, []).append(part)
+        tile_arrays = [
+            xr.concat(tile_parts, dim='time').sortby('time')
+            for tile_parts in per_tile.values()
+        ]
+        return _combine_tiles(tile_arrays, self.fill_value)
 
     # def get_timeseries_xr(self, masked_xarray, to_file=False):
     #     combined_dataset = xr.Dataset()
@@ -359,35 +1111,386 @@ class TimeSeriesByGeom(DataCubeLoader):
 
     #     return combined_dataset
 
-    def get_timeseries_xr(self, masked_xarray, to_file=False):
-        # Preallocate memory for the data and coordinates
-        data_list = np.empty((len(masked_xarray.x), len(masked_xarray.y),
-                              len(masked_xarray.time)))
-        coords = [(x, y) for x in masked_xarray.x.values
-                  for y in masked_xarray.y.values]
-
-        # Fill data_list with the values from masked_xarray
-        for x in range(len(masked_xarray.x)):
-            for y in range(len(masked_xarray.y)):
-                data_list[x, y] = masked_xarray.data[:, y,
-                                                     x].values.astype(float)
-
-        # Create a DataArray for the entire dataset
-        data_array = xr.DataArray(data_list,
-                                  dims=('x', 'y', 'time'),
-                                  coords={
-                                      'x': masked_xarray.x.values,
-                                      'y': masked_xarray.y.values,
-                                      'time': masked_xarray.time
-                                  })
+    def get_timeseries_xr(self,
+                          masked_xarray: xr.Dataset,
+                          to_file: bool = False,
+                          dtype: Optional[np.dtype] = None,
+                          store: Optional[TimeSeriesStore] = None,
+                          layout: str = 'dense',
+                          lonlat: bool = False) -> xr.Dataset:
+        """
+        Rearranges the (time, y, x) output of `masked_array` into an (x, y, time) dataset.
+
+        The transposition is a view on the loaded data, no values are copied unless a
+        different `dtype` is requested.
+
+        Parameters
+        ----------
 
-        # Create the combined dataset
-        combined_dataset = xr.Dataset({'data': data_array})
-        combined_dataset['coords'] = xr.DataArray(coords,
-                                                  dims=['pixel', '(x,y)'])
+        masked_xarray: xr.Dataset
+            Output of `masked_array(..., dtype='xarray')`
+        to_file: bool
+            Write the dataset to "output.nc" in the current working directory. Default: False
+        dtype: Optional[np.dtype]
+            Convert the values, e.g. `np.float64`. Default: None (keep the source dtype).
+            Raw (`storage='raw'`) data is decoded to this dtype instead of being cast.
+        store: Optional[TimeSeriesStore]
+            Append the time steps that are not stored yet to the store of the test area.
+            Default: None
+        layout: str
+            'dense' or 'sparse'. The sparse layout only keeps pixels inside the test area
+            with at least one valid value as a (pixel, time) array, see `sparse_to_dense`.
+            Default: 'dense'
+        lonlat: bool
+            Attach 'lon'/'lat' coordinates of every pixel. Default: False
+
+        Returns
+        -------
+
+        combined_dataset: xr.Dataset
+            'data' with dims (x, y, time) and 'coords' with the (x, y) pair of every pixel,
+            or 'data' with dims (pixel, time) and x/y coordinates per pixel (sparse)
+        """
+        if layout not in ('dense', 'sparse'):
+            raise ValueError(
+                f"layout must be 'dense' or 'sparse', not '{layout}'")
+
+        with stage('xarray_conversion', layout=layout):
+            source = masked_xarray['data']
+            if dtype is not None and 'scale_factor' in source.attrs:
+                source = decode(source, dtype=dtype)
+
+            if layout == 'sparse':
+                combined_dataset = self._sparse_timeseries(
+                    masked_xarray, source, dtype)
+            else:
+                data = source.transpose('x', 'y', 'time').data
+                if dtype is not None:
+                    data = data.astype(dtype, copy=False)
+                combined_dataset = _dense_dataset(data,
+                                                  masked_xarray.x.values,
+                                                  masked_xarray.y.values,
+                                                  masked_xarray.time,
+                                                  dict(source.attrs))
+
+            if lonlat:
+                combined_dataset = add_lonlat(combined_dataset,
+                                              self.projection_crs,
+                                              self.lonlat_crs)
+            count(pixels=combined_dataset['data'].size)
 
         if to_file:
-            combined_dataset.to_netcdf('output.nc')
+            # raw data is written as int16 with its CF attributes, readers decode it on access
+            combined_dataset.to_netcdf(
+                'output.nc', encoding={'data': {
+                    'zlib': True,
+                    'complevel': 4
+                }})
             print(f'Saved to file "output.nc" in {os.getcwd()}')
 
+        if store is not None:
+            store.append(self.testarea, combined_dataset)
+
         return combined_dataset
+
+    def _sparse_timeseries(self, masked_xarray: xr.Dataset,
+                           source: xr.DataArray,
+                           dtype: Optional[np.dtype]) -> xr.Dataset:
+        x_values = masked_xarray.x.values
+        y_values = masked_xarray.y.values
+        values = np.asarray(source.transpose('time', 'y', 'x').data)
+
+        nodata = source.attrs.get('_FillValue')
+        if nodata is not None:
+            valid = (values != nodata).any(axis=0)
+        else:
+            valid = np.isfinite(values).any(axis=0)
+
+        tiles = masked_xarray.attrs.get('tiles')
+        if tiles:
+            valid &= self.pixel_mask(self.testarea, tiles.split(','),
+                                     x_values, y_values)
+
+        y_idx, x_idx = np.nonzero(valid)
+        data = values[:, y_idx, x_idx].T  # copies the valid pixels only
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+
+        data_array = xr.DataArray(data,
+                                  dims=('pixel', 'time'),
+                                  coords={
+                                      'x': ('pixel', x_values[x_idx]),
+                                      'y': ('pixel', y_values[y_idx]),
+                                      'time': masked_xarray.time
+                                  },
+                                  attrs=dict(source.attrs))
+        return xr.Dataset({'data': data_array},
+                          attrs=_grid_attrs(x_values, y_values,
+                                            self.resolution))
+
+    def update_store(self,
+                     store: TimeSeriesStore,
+                     datacube: Optional[ProductDataCube] = None,
+                     **masked_array_kwargs) -> int:
+        """
+        Loads only the acquisitions that are not in the store yet and appends them.
+
+        Parameters
+        ----------
+
+        store: TimeSeriesStore
+            The store to update
+        datacube: Optional[ProductDataCube]
+            The (filtered) datacube, e.g. one polarisation. Default: None (`self.datacube`)
+        **masked_array_kwargs
+            Passed on to `masked_array`
+
+        Returns
+        -------
+
+        int
+            Number of appended time steps
+        """
+        if datacube is None:
+            datacube = self.datacube
+        # dates without a file of the test area's tiles are not new
+        datacube = self.filter_spatially(datacube)
+
+        stored_times = store.stored_times(self.testarea)
+        times = pd.DatetimeIndex(datacube.inventory['time'].unique())
+        new_times = times[~times.isin(stored_times)]
+        if len(new_times) == 0:
+            return 0
+
+        new_cube = datacube.filter_by_dimension(list(
+            new_times.to_pydatetime()),
+                                                name='time')
+        masked_xarray = self.masked_array(new_cube, **masked_array_kwargs)
+        return store.append(self.testarea,
+                            self.get_timeseries_xr(masked_xarray))
+
+
+def _dense_dataset(data, x_values: np.ndarray, y_values: np.ndarray, time,
+                   attrs: dict) -> xr.Dataset:
+    """
+    The dense `get_timeseries_xr` layout of an (x, y, time) array.
+    """
+    data_array = xr.DataArray(data,
+                              dims=('x', 'y', 'time'),
+                              coords={
+                                  'x': x_values,
+                                  'y': y_values,
+                                  'time': time
+                              },
+                              attrs=attrs)
+
+    # (x, y) pair of every pixel, x varying slowest as in the data array
+    coords = np.column_stack([
+        np.repeat(x_values, len(y_values)),
+        np.tile(y_values, len(x_values))
+    ])
+
+    combined_dataset = xr.Dataset({'data': data_array})
+    combined_dataset['coords'] = xr.DataArray(coords, dims=['pixel', '(x,y)'])
+    return combined_dataset
+
+
+def _grid_attrs(x_values: np.ndarray, y_values: np.ndarray,
+                resolution: int) -> Dict[str, float]:
+    """
+    Origin, spacing and size of the regular window grid, kept by the sparse layout.
+    """
+    return {
+        'x0': float(x_values[0]) if len(x_values) else 0.,
+        'dx': float(x_values[1] - x_values[0])
+        if len(x_values) > 1 else float(resolution),
+        'nx': len(x_values),
+        'y0': float(y_values[0]) if len(y_values) else 0.,
+        'dy': float(y_values[1] - y_values[0])
+        if len(y_values) > 1 else -float(resolution),
+        'ny': len(y_values)
+    }
+
+
+def sparse_to_dense(dataset: xr.Dataset) -> xr.Dataset:
+    """
+    Converts the sparse (pixel, time) layout of `get_timeseries_xr` back to the dense one.
+
+    Pixels that were dropped are filled with the nodata value ('_FillValue') of raw data
+    and NaN otherwise.
+
+    Parameters
+    ----------
+
+    dataset: xr.Dataset
+        Output of `get_timeseries_xr(..., layout='sparse')`
+
+    Returns
+    -------
+
+    xr.Dataset
+        'data' with dims (x, y, time) and 'coords' with the (x, y) pair of every pixel
+    """
+    grid = dataset.attrs
+    x_values = grid['x0'] + grid['dx'] * np.arange(grid['nx'])
+    y_values = grid['y0'] + grid['dy'] * np.arange(grid['ny'])
+    x_idx = np.rint((dataset.x.values - grid['x0']) / grid['dx']).astype(int)
+    y_idx = np.rint((dataset.y.values - grid['y0']) / grid['dy']).astype(int)
+
+    data = dataset['data']
+    if '_FillValue' in data.attrs:
+        fill_value, fill_dtype = data.attrs['_FillValue'], data.dtype
+    else:
+        fill_value, fill_dtype = np.nan, np.result_type(data.dtype, np.float32)
+    dense = np.full((grid['nx'], grid['ny'], data.sizes['time']),
+                    fill_value,
+                    dtype=fill_dtype)
+    dense[x_idx, y_idx, :] = data.transpose('pixel', 'time').values
+
+    return _dense_dataset(dense, x_values, y_values, dataset.time,
+                          dict(data.attrs))
+
+
+def _cut_area(dataset: xr.Dataset,
+              testarea: TestArea,
+              loader: DataCubeLoader,
+              tiles: List[str],
+              apply_mask: bool = False) -> xr.Dataset:
+    """
+    Cuts the window of `testarea` out of a (time, y, x) dataset loaded for a larger region.
+    """
+    projected = Polygon(loader.project(testarea.coords))
+    min_x, min_y, max_x, max_y = projected.bounds
+    half_pixel = loader.resolution / 2
+
+    x_values, y_values = dataset.x.values, dataset.y.values
+    x_idx = np.flatnonzero((x_values >= min_x - half_pixel)
+                           & (x_values <= max_x + half_pixel))
+    y_idx = np.flatnonzero((y_values >= min_y - half_pixel)
+                           & (y_values <= max_y + half_pixel))
+    window = dataset.isel(x=x_idx, y=y_idx)
+    window.attrs['tiles'] = ','.join(tiles)
+
+    if apply_mask:
+        window = loader.apply_pixel_mask(
+            window,
+            loader.pixel_mask(testarea, tiles, window.x.values,
+                              window.y.values))
+    return window
+
+
+def _cluster_windows(bounds: np.ndarray, resolution: int,
+                     max_window_pixels: int) -> List[List[int]]:
+    """
+    Greedy spatial clustering of projected (min_x, min_y, max_x, max_y) bounds.
+
+    An area joins the first cluster whose union window stays within
+    `max_window_pixels`, otherwise it starts a new one. Areas larger than the cap get
+    their own window.
+    """
+    clusters: List[List[int]] = []
+    windows: List[np.ndarray] = []
+    for i in np.lexsort((bounds[:, 1], bounds[:, 0])):
+        for members, window in zip(clusters, windows):
+            union = np.concatenate(
+                [np.minimum(window[:2], bounds[i, :2]),
+                 np.maximum(window[2:], bounds[i, 2:])])
+            n_pixels = np.prod((union[2:] - union[:2]) / resolution + 1)
+            if n_pixels <= max_window_pixels:
+                members.append(int(i))
+                window[:] = union
+                break
+        else:
+            clusters.append([int(i)])
+            windows.append(bounds[i].copy())
+    return clusters
+
+
+def masked_arrays_by_tile(testareas: List[TestArea],
+                          loaded_datacube: DataCubeLoader,
+                          datacube: Optional[ProductDataCube] = None,
+                          apply_mask: bool = False,
+                          max_window_pixels: int = 2**20) -> List[xr.Dataset]:
+    """
+    Loads the data of many test areas with one read per cluster of nearby areas.
+
+    The test areas are clustered spatially, so that the bounding box of every cluster
+    stays below `max_window_pixels`. Every cluster is loaded once from the union of
+    the tiles of its areas (areas straddling tiles share the read with their
+    neighbours) and then split back per area. Scattered areas on one tile end up in
+    separate, small windows instead of one window covering most of the tile.
+
+    Parameters
+    ----------
+
+    testareas: List[TestArea]
+        The test areas to extract
+    loaded_datacube: DataCubeLoader
+        Loader providing the spatial reference, grid and (shared) datacube
+    datacube: Optional[ProductDataCube]
+        Pre-filtered datacube (e.g. one polarisation and time range).
+        Default: None (`loaded_datacube.datacube`)
+    apply_mask: bool
+        Mask pixels outside of the test area polygons. Default: False
+    max_window_pixels: int
+        Maximum size of a shared window (per date) in pixels. Default: 2**20
+
+    Returns
+    -------
+
+    List[xr.Dataset]
+        (time, y, x) dataset with variable 'data' per test area, in input order
+    """
+    if datacube is None:
+        datacube = loaded_datacube.datacube
+
+    area_tiles: List[List[str]] = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with stage('geometry_filter'):
+            # (min_x, min_y, max_x, max_y) of every area in the Equi7 projection
+            projected = [
+                loaded_datacube.project(testarea.coords)
+                for testarea in testareas
+            ]
+            projected = np.array([
+                np.concatenate([coords.min(axis=0),
+                                coords.max(axis=0)]) for coords in projected
+            ])
+            for testarea, bounds in zip(testareas, projected):
+                tiles = datacube.filter_spatially_by_geom(
+                    [tuple(bounds[:2]), tuple(bounds[2:])],
+                    sref=loaded_datacube.projection_sref).inventory['tile']
+                if not len(tiles):
+                    raise ValueError(f'No data found for test area {testarea.name}')
+                area_tiles.append(sorted(set(tiles)))
+
+            clusters = _cluster_windows(projected, loaded_datacube.resolution,
+                                        max_window_pixels)
+
+        results: List[Optional[xr.Dataset]] = [None] * len(testareas)
+        for members in clusters:
+            tiles = sorted(set().union(*(area_tiles[i] for i in members)))
+            union_bbox = [tuple(projected[members, :2].min(axis=0)),
+                          tuple(projected[members, 2:].max(axis=0))]
+
+            tile_cube = datacube.filter_by_dimension(tiles, name='tile')
+            with stage('geotiff_read'):
+                loaded = tile_cube.load_by_geom(
+                    union_bbox,
+                    sref=loaded_datacube.projection_sref,
+                    apply_mask=False,
+                    dtype='xarray')
+                loaded = loaded.rename({'1': 'data'})
+                _count_loaded(len(tile_cube.inventory), loaded['data'],
+                              loaded_datacube.product.name)
+            if loaded_datacube.storage == 'raw':
+                loaded['data'].attrs.update(loaded_datacube.encoding_attrs)
+
+            for i in members:
+                results[i] = _cut_area(loaded,
+                                       testareas[i],
+                                       loaded_datacube,
+                                       area_tiles[i],
+                                       apply_mask=apply_mask)
+    return results
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import re
+import warnings
+from typing import Dict, Optional
+
+import numpy as np
+import xarray as xr
+from numcodecs import Blosc
+
+from testarea import TestArea
+from register_index import DEFAULT_CACHE_DIR
+
+CF_ENCODING = ('dtype', 'scale_factor', 'add_offset', '_FillValue')
+
+
+class TimeSeriesStore:
+    '''Appendable, chunked and compressed Zarr store of `get_timeseries_xr` outputs
+
+    Every TestArea gets its own Zarr store below `root_dir`, named after the test area
+    and its geometry. New acquisitions are appended along the time dimension, time
+    steps that are already stored are skipped. Raw data is stored with its CF encoding
+    (e.g. int16 with 'scale_factor' and '_FillValue').
+
+    Parameters
+    ----------
+
+    root_dir: Optional[str]
+        Folder holding the stores. Default: `DEFAULT_CACHE_DIR/timeseries`
+    chunks: Optional[Dict[str, int]]
+        Chunk size per dimension of 'data'. Default: {'x': 256, 'y': 256, 'time': 32}
+    compression_level: int
+        Blosc/zstd compression level. Default: 5
+    '''
+
+    def __init__(self,
+                 root_dir: Optional[str] = None,
+                 chunks: Optional[Dict[str, int]] = None,
+                 compression_level: int = 5) -> None:
+        if root_dir is None:
+            root_dir = os.path.join(DEFAULT_CACHE_DIR, 'timeseries')
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+
+        self.chunks = chunks or {'x': 256, 'y': 256, 'time': 32}
+        self.compressor = Blosc(cname='zstd',
+                                clevel=compression_level,
+                                shuffle=Blosc.BITSHUFFLE)
+
+    def path(self, testarea: TestArea) -> str:
+        '''Store of `testarea`, areas with the same name but another geometry don't collide'''
+        name = re.sub(r'[^\w.-]+', '_', testarea.name)
+        geometry_hash = hashlib.sha1(testarea.shape.wkb).hexdigest()[:12]
+        return os.path.join(self.root_dir, f'{name}_{geometry_hash}.zarr')
+
+    def stored_times(self, testarea: TestArea) -> np.ndarray:
+        '''Returns the time steps already stored for `testarea` (datetime64)'''
+        if not os.path.exists(self.path(testarea)):
+            return np.array([], dtype='datetime64[ns]')
+        with xr.open_zarr(self.path(testarea)) as stored:
+            return stored.time.values
+
+    def open(self, testarea: TestArea) -> xr.Dataset:
+        '''Opens the store of `testarea` lazily, raw values are decoded on access'''
+        return xr.open_zarr(self.path(testarea))
+
+    def append(self, testarea: TestArea, dataset: xr.Dataset) -> int:
+        '''Appends the time steps of `dataset` that are not stored yet
+
+        Parameters
+        ----------
+
+        testarea: TestArea
+            The test area the data belongs to
+        dataset: xr.Dataset
+            Output of `TimeSeriesByGeom.get_timeseries_xr`. The pixel grid is fixed by the
+            first write, later data is reindexed onto it (missing pixels become NaN).
+
+        Returns
+        -------
+
+        int
+            Number of appended time steps
+        '''
+        stored_times = self.stored_times(testarea)
+        new = dataset.sel(
+            time=~np.isin(dataset.time.values, stored_times)).sortby('time')
+        if new.sizes['time'] == 0:
+            return 0
+
+        # raw data: move the CF attributes into the encoding (values are decoded
+        # lazily), so xarray encodes them once and doesn't find them in attrs again
+        new = xr.decode_cf(new)
+        if len(stored_times) == 0:
+            chunks = tuple(
+                min(self.chunks.get(dim, size), size)
+                for dim, size in zip(new['data'].dims, new['data'].shape))
+            encoding = {
+                key: value
+                for key, value in new['data'].encoding.items()
+                if key in CF_ENCODING
+            }
+            new.to_zarr(self.path(testarea),
+                        mode='w',
+                        encoding={
+                            'data': {
+                                **encoding, 'chunks': chunks,
+                                'compressor': self.compressor
+                            }
+                        })
+        else:
+            # the per-pixel coordinates don't change, only 'data' grows along time,
+            # encoded with the encoding of the store
+            with xr.open_zarr(self.path(testarea)) as stored:
+                new = _align_to_store(new, stored, testarea.name)
+            new = new.drop_vars('coords', errors='ignore')
+            for variable in new.variables.values():
+                variable.encoding = {}
+            new.to_zarr(self.path(testarea), append_dim='time')
+        return new.sizes['time']
+
+
+def _align_to_store(new: xr.Dataset, stored: xr.Dataset,
+                    name: str) -> xr.Dataset:
+    '''`new` (decoded) on the pixel grid of `stored`, missing pixels are NaN
+
+    Dense data has to lie on the stored x/y grid. Sparse data keeps the stored pixel
+    index, pixels that are not in it can't be appended and are dropped with a warning.
+    '''
+    if 'pixel' not in new['data'].dims:
+        if (np.array_equal(new.x.values, stored.x.values)
+                and np.array_equal(new.y.values, stored.y.values)):
+            return new
+        if not (np.isin(new.x.values, stored.x.values).all()
+                and np.isin(new.y.values, stored.y.values).all()):
+            raise ValueError(
+                f'The x/y grid of the new data of {name} is not part of the grid of '
+                'its store, e.g. because of another resolution. Write it to a new '
+                'store instead.')
+        return new.drop_vars('coords', errors='ignore').reindex(
+            x=stored.x.values, y=stored.y.values)
+
+    stored_xy = list(zip(stored.x.values.tolist(), stored.y.values.tolist()))
+    new_xy = list(zip(new.x.values.tolist(), new.y.values.tolist()))
+    if new_xy == stored_xy:
+        return new
+    dropped = len(set(new_xy).difference(stored_xy))
+    if dropped:
+        warnings.warn(f'{dropped} pixels of {name} are not in the pixel index '
+                      'of its store and are not appended')
+
+    position = dict(zip(new_xy, range(len(new_xy))))
+    index = np.array([position.get(xy, -1) for xy in stored_xy], dtype=int)
+    found = index >= 0
+    values = np.full((len(index), new.sizes['time']),
+                     np.nan,
+                     dtype=np.result_type(new['data'].dtype, np.float32))
+    values[found] = new['data'].transpose('pixel', 'time').values[index[found]]
+    data = xr.DataArray(values,
+                        dims=('pixel', 'time'),
+                        coords={
+                            'x': ('pixel', stored.x.values),
+                            'y': ('pixel', stored.y.values),
+                            'time': new.time
+                        },
+                        attrs=new['data'].attrs)
+    return xr.Dataset({'data': data}, attrs=new.attrs)
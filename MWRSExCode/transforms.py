@@ -0,0 +1,90 @@
+import threading
+from functools import lru_cache
+from typing import Tuple, Union
+
+import numpy as np
+import xarray as xr
+from pyproj import CRS, Transformer
+
+CRSLike = Union[str, int]
+
+
+@lru_cache(maxsize=None)
+def get_crs(crs: CRSLike) -> CRS:
+    '''Cached `pyproj.CRS` of an EPSG code, 'EPSG:xxxx' string or WKT'''
+    return CRS.from_user_input(crs)
+
+
+# pyproj transformers are not thread-safe, every thread gets its own. The cache lives
+# in thread-local storage, so it is freed together with short-lived worker threads.
+_local = threading.local()
+
+
+def get_transformer(src_crs: CRSLike, dst_crs: CRSLike) -> Transformer:
+    '''Cached (per thread) transformer from `src_crs` to `dst_crs`, axis order (x, y)'''
+    transformers = getattr(_local, 'transformers', None)
+    if transformers is None:
+        transformers = _local.transformers = {}
+    transformer = transformers.get((src_crs, dst_crs))
+    if transformer is None:
+        transformer = Transformer.from_crs(get_crs(src_crs),
+                                           get_crs(dst_crs),
+                                           always_xy=True)
+        transformers[(src_crs, dst_crs)] = transformer
+    return transformer
+
+
+def transform_coords(x: np.ndarray, y: np.ndarray, src_crs: CRSLike,
+                     dst_crs: CRSLike) -> Tuple[np.ndarray, np.ndarray]:
+    '''Transforms whole coordinate arrays with one vectorized call
+
+    Parameters
+    ----------
+
+    x, y: np.ndarray
+        Coordinates in `src_crs` (lon, lat for geographic systems), any shape
+    src_crs, dst_crs: CRSLike
+        EPSG code, 'EPSG:xxxx' string or WKT
+
+    Returns
+    -------
+
+    Tuple[np.ndarray, np.ndarray]
+        Transformed (x, y) with the shape of the input
+    '''
+    return get_transformer(src_crs, dst_crs).transform(
+        np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+
+def add_lonlat(dataset: xr.Dataset,
+               crs: CRSLike,
+               lonlat_crs: CRSLike = 'EPSG:4326') -> xr.Dataset:
+    '''Attaches 'lon' and 'lat' coordinates to a dataset with projected x/y coordinates
+
+    Works for the dense (x, y, ...) layout, where lon/lat get the dims (x, y), and for
+    the sparse layout, where x/y are coordinates along 'pixel'.
+
+    Parameters
+    ----------
+
+    dataset: xr.Dataset
+        Output of `TimeSeriesByGeom.get_timeseries_xr` or `masked_array`
+    crs: CRSLike
+        Projection of the x/y coordinates, e.g. `DataCubeLoader.projection_crs`
+    lonlat_crs: CRSLike
+        Geographic system of the result. Default: 'EPSG:4326'
+
+    Returns
+    -------
+
+    xr.Dataset
+    '''
+    if dataset.x.dims == ('x', ):
+        dims = ('x', 'y')
+        x, y = np.meshgrid(dataset.x.values, dataset.y.values, indexing='ij')
+    else:
+        dims = dataset.x.dims
+        x, y = dataset.x.values, dataset.y.values
+
+    lon, lat = transform_coords(x, y, crs, lonlat_crs)
+    return dataset.assign_coords(lon=(dims, lon), lat=(dims, lat))
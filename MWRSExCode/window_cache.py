@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time as _time
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from numpy.lib.format import open_memmap
+from yeoda.products.base import ProductDataCube
+
+from register_index import DEFAULT_CACHE_DIR
+from testarea import TestArea
+from timeseries_by_geom import TemporalWindow, TimeSeriesByGeom
+
+
+class WindowStackCache:
+    '''Persistent cache of the unmasked (time, y, x) windows loaded by `masked_array`
+
+    Every entry is a folder with the stack as a raw .npy file, the x/y/time
+    coordinates and a JSON sidecar. Entries are keyed by the test area geometry, the
+    tiles, variable, polarisation, time range and storage mode, and opened as
+    read-only memory maps, so a cache hit doesn't copy the values. Dates of the
+    datacube that are not in an entry yet are loaded and merged into it. The least
+    recently used entries are evicted when the cache grows beyond `max_bytes`.
+
+    Parameters
+    ----------
+
+    cache_dir: str
+        Folder of the cache. Default: `DEFAULT_CACHE_DIR/windows`
+    max_bytes: int
+        Size limit of all entries. Default: 10 GiB
+    '''
+
+    def __init__(self,
+                 cache_dir: str = os.path.join(DEFAULT_CACHE_DIR, 'windows'),
+                 max_bytes: int = 10 * 2**30) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(testarea: TestArea,
+            inventory: pd.DataFrame,
+            temporal_window: Optional[TemporalWindow] = None,
+            storage: str = 'decoded') -> str:
+        '''sha1 of the geometry, tiles, variables, polarisations, time range and storage'''
+
+        def values(column):
+            if column not in inventory:
+                return ''
+            return ','.join(sorted(inventory[column].astype(str).unique()))
+
+        time_range = 'all' if temporal_window is None else (
+            f'{temporal_window.start:%Y%m%dT%H%M%S}_'
+            f'{temporal_window.end:%Y%m%dT%H%M%S}')
+        parts = [
+            hashlib.sha1(testarea.shape.wkb).hexdigest(),
+            values('tile'),
+            values('var_name'),
+            values('pol'), time_range, storage
+        ]
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        meta_path = os.path.join(self._entry_dir(key), 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        meta_path = os.path.join(self._entry_dir(key), 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, default=str)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _open(self, key: str, meta: dict) -> Optional[xr.Dataset]:
+        entry_dir = self._entry_dir(key)
+        try:
+            data = np.load(os.path.join(entry_dir, 'data.npy'), mmap_mode='r')
+            with np.load(os.path.join(entry_dir, 'coords.npz')) as coords:
+                time, y, x = coords['time'], coords['y'], coords['x']
+        except FileNotFoundError:  # replaced or evicted by another process
+            return None
+        if data.shape != (len(time), len(y), len(x)):
+            return None
+        return xr.Dataset(
+            {
+                'data':
+                xr.DataArray(data,
+                             dims=('time', 'y', 'x'),
+                             attrs=meta['data_attrs'])
+            },
+            coords={
+                'time': time,
+                'y': y,
+                'x': x
+            },
+            attrs=meta['attrs'])
+
+    def _store(self, key: str, cached: Optional[xr.Dataset],
+               new: xr.Dataset) -> dict:
+        '''Writes the time-sorted union of `cached` and `new` as the entry `key`
+
+        The entry is written to a temporary folder and published with a rename, so
+        readers see either the old or the new data, coordinates and metadata.
+        '''
+        tmp_dir = tempfile.mkdtemp(prefix=f'{key}.', dir=self.cache_dir)
+
+        parts = [new] if cached is None else [cached, new]
+        times = np.concatenate([part.time.values for part in parts])
+        order = np.argsort(times, kind='stable')
+        positions = np.empty_like(order)
+        positions[order] = np.arange(len(order))
+
+        out = open_memmap(os.path.join(tmp_dir, 'data.npy'),
+                          mode='w+',
+                          dtype=new['data'].dtype,
+                          shape=(len(times), len(new.y), len(new.x)))
+        start = 0
+        for part in parts:
+            stop = start + len(part.time)
+            out[positions[start:stop]] = part['data'].transpose(
+                'time', 'y', 'x').values
+            start = stop
+        out.flush()
+        nbytes = out.nbytes
+        del out
+        np.savez(os.path.join(tmp_dir, 'coords.npz'),
+                 time=times[order],
+                 y=new.y.values,
+                 x=new.x.values)
+
+        meta = {
+            'nbytes': nbytes,
+            'last_access': _time.time(),
+            'attrs': dict(new.attrs),
+            'data_attrs': {
+                name: value.item() if isinstance(value, np.generic) else value
+                for name, value in new['data'].attrs.items()
+            }
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, default=str)
+
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            # a directory can't be replaced in one step: move the old entry aside first,
+            # open memory maps of it stay valid until they are closed
+            old_dir = None
+            if os.path.isdir(entry_dir):
+                old_dir = tempfile.mkdtemp(prefix=f'{key}.', dir=self.cache_dir)
+                os.rename(entry_dir, os.path.join(old_dir, 'entry'))
+            os.rename(tmp_dir, entry_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+        return meta
+
+    def entries(self) -> List[dict]:
+        '''Key, size and last access of every entry'''
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if '.' in key:  # entry being written or removed
+                continue
+            meta = self._read_meta(key)
+            if meta is not None:
+                entries.append({
+                    'key': key,
+                    'nbytes': meta['nbytes'],
+                    'last_access': meta['last_access']
+                })
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        '''Removes the least recently used entries until the cache fits `max_bytes`'''
+        entries = sorted(self.entries(), key=lambda entry: entry['last_access'])
+        total = sum(entry['nbytes'] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry['key'] == keep:
+                continue
+            shutil.rmtree(self._entry_dir(entry['key']), ignore_errors=True)
+            total -= entry['nbytes']
+            removed.append(entry['key'])
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in os.listdir(self.cache_dir):
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def masked_array(self,
+                     timeseries: TimeSeriesByGeom,
+                     datacube: Optional[ProductDataCube] = None,
+                     temporal_window: Optional[TemporalWindow] = None,
+                     apply_mask: bool = False,
+                     **masked_array_kwargs) -> xr.Dataset:
+        '''Cached `timeseries.masked_array`, only dates missing from the cache are read
+
+        Parameters
+        ----------
+
+        timeseries: TimeSeriesByGeom
+            Provides the test area and the loader settings
+        datacube: Optional[ProductDataCube]
+            The (filtered) datacube, e.g. one polarisation. Default: None (`timeseries.datacube`)
+        temporal_window: Optional[TemporalWindow]
+            Restrict the datacube to this time range (end excluded). Default: None
+        apply_mask: bool
+            Mask pixels outside of the test area. The masked result is a copy, without
+            masking the values stay memory-mapped. Default: False
+        **masked_array_kwargs
+            Passed on to `masked_array` for the missing dates, e.g. `prefetch`
+
+        Returns
+        -------
+
+        xr.Dataset
+            (time, y, x) dataset with variable 'data' of the dates in the datacube, as
+            returned by `masked_array`
+        '''
+        if datacube is None:
+            datacube = timeseries.datacube
+        if temporal_window is not None:
+            datacube = datacube.filter_by_dimension(
+                [(temporal_window.start, temporal_window.end)], [('>=', '<')],
+                name='time')
+
+        # the key and the missing dates only depend on the tiles of the test area
+        datacube = timeseries.filter_spatially(datacube)
+        inventory = datacube.inventory
+        requested = pd.DatetimeIndex(inventory['time'].unique()).sort_values()
+        if not len(requested):
+            raise ValueError('The datacube contains no files of the test area')
+        key = self.key(timeseries.testarea, inventory, temporal_window,
+                       timeseries.storage)
+
+        # the lock only covers the metadata and memory maps, reads run concurrently
+        with self._lock:
+            meta = self._read_meta(key)
+            cached = None if meta is None else self._open(key, meta)
+
+        times = requested
+        if cached is not None:
+            times = times[~times.isin(cached.time.values)]
+
+        if len(times):
+            new = timeseries.masked_array(datacube.filter_by_dimension(
+                list(times.to_pydatetime()), name='time'),
+                                          apply_mask=False,
+                                          **masked_array_kwargs)
+            if cached is not None and not (
+                    np.array_equal(cached.x.values, new.x.values)
+                    and np.array_equal(cached.y.values, new.y.values)):
+                # the window changed (e.g. new tiles), start over
+                cached = None
+                new = timeseries.masked_array(datacube,
+                                              apply_mask=False,
+                                              **masked_array_kwargs)
+            meta = self._store(key, cached, new)
+            with self._lock:
+                self.evict(keep=key)
+                result = self._open(key, meta)
+            if result is None:  # replaced by another process meanwhile
+                result = xr.concat([part for part in (cached, new)
+                                    if part is not None],
+                                   dim='time').sortby('time')
+        else:
+            with self._lock:
+                meta['last_access'] = _time.time()
+                self._write_meta(key, meta)
+            result = cached
+
+        # an entry keyed without a time range holds every date loaded so far
+        if not np.array_equal(result.time.values, requested.values):
+            result = result.sel(time=requested.values)
+
+        if apply_mask:
+            tiles = result.attrs.get('tiles', '')
+            result = timeseries.apply_pixel_mask(
+                result,
+                timeseries.pixel_mask(timeseries.testarea, tiles.split(','),
+                                      result.x.values, result.y.values))
+        return result
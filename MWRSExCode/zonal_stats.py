@@ -0,0 +1,217 @@
+import re
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from yeoda.products.base import ProductDataCube
+
+from prefetch import DEFAULT_MAX_BYTES, PrefetchReader
+from testarea import TestArea
+from timeseries_by_geom import (DataCubeLoader, TimeSeriesByGeom, _load_part,
+                                build_datacube, decode)
+
+DEFAULT_STATISTICS = ('mean', 'median', 'std', 'p10', 'p90', 'count')
+
+
+STATISTICS = ('mean', 'median', 'std', 'min', 'max', 'count')
+PERCENTILE_PATTERN = re.compile(r'p(\d{1,2}(\.\d+)?)')  # e.g. 'p10', 'p2.5'
+
+
+def _percentile(statistic: str) -> Optional[float]:
+    '''Percentile of 'median' or 'p<q>', None for other statistics'''
+    if statistic == 'median':
+        return 50.
+    match = PERCENTILE_PATTERN.fullmatch(statistic)
+    return None if match is None else float(match.group(1))
+
+
+def _check_statistics(statistics: Sequence[str]) -> None:
+    unknown = [
+        s for s in statistics if s not in STATISTICS and _percentile(s) is None
+    ]
+    if unknown:
+        raise ValueError(f'Unknown statistics {unknown}, use any of '
+                         f'{list(STATISTICS)} or percentiles p<q> (e.g. p10)')
+
+
+def _column(statistic: str, linear: bool) -> str:
+    '''Column name of `statistic`, 'std' stays in linear power with `linear`'''
+    return 'std_linear' if linear and statistic == 'std' else statistic
+
+
+def _reduce(values: np.ndarray, statistics: Sequence[str],
+            linear: bool) -> Dict[str, float]:
+    '''Reduces the valid sigma0 values [dB] of one date to the requested statistics'''
+    if linear:
+        values = 10**(values / 10)
+
+    result = {}
+    percentiles = {s: _percentile(s) for s in statistics}
+    percentiles = {s: q for s, q in percentiles.items() if q is not None}
+    if percentiles and values.size:
+        result.update(
+            zip(percentiles, np.percentile(values, list(percentiles.values()))))
+
+    for statistic in statistics:
+        if statistic == 'count':
+            result['count'] = values.size
+        elif statistic in percentiles:
+            result.setdefault(statistic, np.nan)
+        elif not values.size:
+            result[statistic] = np.nan
+        elif statistic == 'mean':
+            result['mean'] = values.mean()
+        elif statistic == 'std':
+            result['std'] = values.std()
+        elif statistic == 'min':
+            result['min'] = values.min()
+        elif statistic == 'max':
+            result['max'] = values.max()
+
+    if linear:
+        # location statistics back to dB, the spread stays in linear power
+        for statistic in result:
+            if statistic not in ('std', 'count'):
+                result[statistic] = 10 * np.log10(result[statistic])
+    return {_column(name, linear): value for name, value in result.items()}
+
+
+def _masked_values(timeseries: TimeSeriesByGeom,
+                   window: xr.Dataset) -> np.ndarray:
+    '''Masked and decoded values of a window loaded with `_load_part`'''
+    tiles = sorted(window.attrs['tiles'].split(','))
+    window = timeseries.apply_pixel_mask(
+        window,
+        timeseries.pixel_mask(timeseries.testarea, tiles, window.x.values,
+                              window.y.values))['data']
+    if timeseries.storage == 'raw':
+        window = decode(window.assign_attrs(timeseries.encoding_attrs))
+    return window.values
+
+
+def _read_date(timeseries: TimeSeriesByGeom,
+               files: pd.DataFrame) -> np.ndarray:
+    date_cube = build_datacube(list(files['filepath']),
+                               **timeseries.cube_kwargs)
+    window = timeseries.masked_array(date_cube, apply_mask=True)['data']
+    if 'scale_factor' in window.attrs:
+        window = decode(window)
+    return window.values
+
+
+def zonal_statistics(timeseries: TimeSeriesByGeom,
+                     datacube: Optional[ProductDataCube] = None,
+                     statistics: Sequence[str] = DEFAULT_STATISTICS,
+                     linear: bool = False,
+                     prefetch: int = 0,
+                     max_prefetch_bytes: Optional[int] = DEFAULT_MAX_BYTES
+                     ) -> pd.DataFrame:
+    '''Per-date statistics of the sigma0 values inside a test area
+
+    The files are read one date at a time and every window is reduced right away,
+    so the peak memory is one image window regardless of the time range. With
+    `prefetch` the next dates are read in background threads while the current one
+    is masked and reduced.
+
+    Parameters
+    ----------
+
+    timeseries: TimeSeriesByGeom
+        Provides the test area and the loader settings
+    datacube: Optional[ProductDataCube]
+        The (filtered) datacube, e.g. one polarisation. Default: None (`timeseries.datacube`)
+    statistics: Sequence[str]
+        Any of 'mean', 'median', 'std', 'min', 'max', 'count' and percentiles 'p<q>'
+        (e.g. 'p10'). Default: DEFAULT_STATISTICS
+    linear: bool
+        Compute the statistics in linear power and convert them back to dB. The
+        standard deviation can't be converted and is reported in linear power as
+        column 'std_linear'. Default: False
+    prefetch: int
+        Number of dates read ahead. Default: 0 (off)
+    max_prefetch_bytes: Optional[int]
+        Memory cap of the prefetched windows. Default: 512 MiB
+
+    Returns
+    -------
+
+    pd.DataFrame
+        One row per date, indexed by time
+    '''
+    _check_statistics(statistics)
+    if datacube is None:
+        datacube = timeseries.datacube
+    # only the files of the test area's tiles are grouped and read
+    datacube = timeseries.filter_spatially(datacube)
+
+    inventory = datacube.inventory.sort_values('time')
+    dates = inventory.groupby('time', sort=True)
+    if prefetch > 0:
+        # the reads run in threads, so they get the WKT instead of the OSR object
+        polygon, sref_wkt = timeseries._load_geometry()
+
+        def read(date):
+            _, files = date
+            window = _load_part(list(files['filepath']),
+                                timeseries.cube_kwargs, polygon, sref_wkt,
+                                False)
+            window.attrs['tiles'] = ','.join(files['tile'].unique())
+            return window
+
+        reader = PrefetchReader(read,
+                                queue_depth=prefetch,
+                                n_workers=min(prefetch, 4),
+                                max_bytes=max_prefetch_bytes)
+        windows = ((time, _masked_values(timeseries, window))
+                   for (time, _), window in reader.iter(dates))
+    else:
+        windows = ((time, _read_date(timeseries, files))
+                   for time, files in dates)
+
+    rows = []
+    for time, values in windows:
+        rows.append({
+            'time': time,
+            **_reduce(values[np.isfinite(values)], statistics, linear)
+        })
+
+    columns = [_column(statistic, linear) for statistic in statistics]
+    return pd.DataFrame(rows, columns=['time', *columns]).set_index('time')
+
+
+def zonal_statistics_by_forest_type(
+        testareas: List[TestArea],
+        loaded_datacube: DataCubeLoader,
+        datacube: Optional[ProductDataCube] = None,
+        statistics: Sequence[str] = DEFAULT_STATISTICS,
+        linear: bool = False,
+        prefetch: int = 0,
+        max_prefetch_bytes: Optional[int] = DEFAULT_MAX_BYTES
+) -> pd.DataFrame:
+    '''Runs `zonal_statistics` for many test areas and groups them by forest type
+
+    The arguments besides `testareas` and `loaded_datacube` are passed on to
+    `zonal_statistics`.
+
+    Returns
+    -------
+
+    pd.DataFrame
+        Statistics indexed by (forest_type, name, time)
+    '''
+    frames = []
+    for testarea in testareas:
+        frame = zonal_statistics(TimeSeriesByGeom(testarea, loaded_datacube),
+                                 datacube=datacube,
+                                 statistics=statistics,
+                                 linear=linear,
+                                 prefetch=prefetch,
+                                 max_prefetch_bytes=max_prefetch_bytes
+                                 ).reset_index()
+        frame['forest_type'] = testarea.forest_type
+        frame['name'] = testarea.name
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True).set_index(
+        ['forest_type', 'name', 'time']).sort_index()
@@ -0,0 +1,230 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+from typing import Callable, List, Sequence
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon, box, mapping
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 'MWRSExCode'))
+
+from mask_cache import PixelMaskCache
+from polygoner import get_polygons_by_ids
+from synthetic_archive import generate_archive, tile_geotransform
+from testarea import TestArea
+from timeseries_by_geom import DataCubeLoader, TimeSeriesByGeom, build_datacube
+from transforms import transform_coords
+
+
+def measure(fn: Callable, stage: str, items: int = 0, unit: str = '',
+            **params) -> tuple:
+    '''Runs `fn()` once and returns its result and a record of wall time and peak memory
+
+    The peak memory is what tracemalloc sees, i.e. Python and numpy allocations; memory
+    allocated inside GDAL is not included.
+    '''
+    gc.collect()
+    tracemalloc.start()
+    start = perf_counter()
+    result = fn()
+    seconds = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if callable(items):
+        items = items(result)
+    return result, {
+        'stage': stage,
+        **params,
+        'seconds': seconds,
+        'peak_mb': peak / 2**20,
+        'items': items,
+        'throughput': items / seconds if items and seconds else np.nan,
+        'unit': unit
+    }
+
+
+def square_testarea(loader: DataCubeLoader, center: tuple,
+                    size_km: float) -> TestArea:
+    '''A square TestArea (EPSG:4326) of `size_km` around a projected `center`'''
+    half = size_km * 500
+    x, y = box(center[0] - half, center[1] - half, center[0] + half,
+               center[1] + half).exterior.coords.xy
+    lon, lat = transform_coords(np.array(x), np.array(y),
+                                loader.projection_crs, loader.lonlat_crs)
+    return TestArea(name=f'square_{size_km}km',
+                    forest_type='synthetic',
+                    _geom=mapping(Polygon(zip(lon, lat))))
+
+
+def synthetic_shapefile(path: str, n_polygons: int,
+                        seed: int = 42) -> List[str]:
+    '''Writes `n_polygons` random squares over Austria (EPSG:3035) with an "ID" column'''
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(4.3e6, 4.9e6, n_polygons)
+    y = rng.uniform(2.6e6, 2.9e6, n_polygons)
+    ids = [f'{i:07}' for i in range(n_polygons)]
+    gpd.GeoDataFrame({'ID': ids},
+                     geometry=[box(*xy, xy[0] + 500, xy[1] + 500)
+                               for xy in zip(x, y)],
+                     crs='EPSG:3035').to_file(path)
+    return ids
+
+
+def run_benchmarks(workdir: str,
+                   area_sizes_km: Sequence[float] = (1, 5, 20),
+                   time_lengths: Sequence[int] = (10, 30),
+                   resolution: int = 500,
+                   tile: str = 'E048N012T6',
+                   n_polygons: int = 10000) -> pd.DataFrame:
+    '''Benchmarks the loading stages on a synthetic archive in `workdir`
+
+    The archive is generated on the first run (`max(time_lengths)` dates) and reused
+    afterwards. Every stage runs once per configuration.
+
+    Returns
+    -------
+
+    pd.DataFrame
+        One row per stage and configuration
+    '''
+    archive_path = os.path.join(workdir, f'EU{resolution:03}M')
+    if not os.path.isdir(archive_path):
+        print(f'Generating synthetic archive in {workdir}...')
+        generate_archive(workdir,
+                         tiles=[tile],
+                         resolution=resolution,
+                         n_dates=max(time_lengths))
+
+    records = []
+    index_path = os.path.join(workdir, 'benchmark_index.sqlite')
+    if os.path.isfile(index_path):
+        os.remove(index_path)
+    loader_kwargs = dict(resolution=resolution,
+                         root_path=archive_path,
+                         index_path=index_path,
+                         mask_cache=PixelMaskCache(cache_dir=None))
+
+    n_files = lambda loader: len(loader.file_register)
+    _, record = measure(lambda: DataCubeLoader(**loader_kwargs), 'index (cold)',
+                        n_files, 'files/s')
+    records.append(record)
+    loader, record = measure(lambda: DataCubeLoader(**loader_kwargs),
+                             'index (warm)', n_files, 'files/s')
+    records.append(record)
+    datacube, record = measure(
+        lambda: build_datacube(loader.file_register, **loader.cube_kwargs),
+        'datacube', len(loader.file_register), 'files/s')
+    records.append(record)
+
+    datacube = datacube.filter_by_dimension(['VV'], name='pol')
+    times = sorted(datacube.inventory['time'].unique())
+    geotransform, n_pixels = tile_geotransform(tile, resolution)
+    center = (geotransform[0] + n_pixels * resolution / 2,
+              geotransform[3] - n_pixels * resolution / 2)
+
+    for n_dates in time_lengths:
+        cube = datacube.filter_by_dimension([(times[0], times[n_dates - 1])],
+                                            [('>=', '<=')],
+                                            name='time')
+        for size_km in area_sizes_km:
+            timeseries = TimeSeriesByGeom(
+                square_testarea(loader, center, size_km), loader)
+            params = {'area_km': size_km, 'n_dates': n_dates}
+            masked, record = measure(
+                lambda: timeseries.masked_array(cube, apply_mask=True),
+                'masked_array', lambda result: result['data'].size,
+                'pixels/s', **params)
+            records.append(record)
+            _, record = measure(
+                lambda: timeseries.get_timeseries_xr(masked),
+                'get_timeseries_xr', masked['data'].size, 'pixels/s',
+                **params)
+            records.append(record)
+            _, record = measure(
+                lambda: timeseries.get_timeseries_xr(masked, layout='sparse'),
+                'get_timeseries_xr (sparse)', masked['data'].size,
+                'pixels/s', **params)
+            records.append(record)
+
+    shapefile_path = os.path.join(workdir, f'polygons_{n_polygons}.shp')
+    if not os.path.isfile(shapefile_path):
+        ids = synthetic_shapefile(shapefile_path, n_polygons)
+    else:
+        ids = [f'{i:07}' for i in range(n_polygons)]
+    cache_dir = tempfile.mkdtemp(dir=workdir)
+    lookup_ids = ids[::max(1, n_polygons // 100)]
+    for stage in ('polygoner (cold)', 'polygoner (warm)'):
+        _, record = measure(
+            lambda: get_polygons_by_ids(lookup_ids,
+                                        shapefile_path=shapefile_path,
+                                        cache_dir=cache_dir), stage,
+            len(lookup_ids), 'polygons/s', n_polygons=n_polygons)
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def compare(results: pd.DataFrame,
+            baseline: pd.DataFrame,
+            tolerance: float = 1.25) -> pd.DataFrame:
+    '''Rows of `results` that are more than `tolerance` times slower than the baseline'''
+    keys = [
+        column for column in ('stage', 'area_km', 'n_dates', 'n_polygons')
+        if column in results and column in baseline
+    ]
+    merged = results.merge(baseline[keys + ['seconds']],
+                           on=keys,
+                           suffixes=('', '_baseline'))
+    merged['ratio'] = merged['seconds'] / merged['seconds_baseline']
+    return merged[merged['ratio'] > tolerance]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark the loading stages on a synthetic archive')
+    parser.add_argument('--workdir',
+                        default=os.path.join(tempfile.gettempdir(),
+                                             'mwrs23_benchmark'))
+    parser.add_argument('--area-sizes', nargs='+', type=float, default=(1, 5, 20))
+    parser.add_argument('--time-lengths', nargs='+', type=int, default=(10, 30))
+    parser.add_argument('--resolution', type=int, default=500)
+    parser.add_argument('--n-polygons', type=int, default=10000)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline',
+                        default=None,
+                        help='Results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = run_benchmarks(args.workdir,
+                             area_sizes_km=args.area_sizes,
+                             time_lengths=args.time_lengths,
+                             resolution=args.resolution,
+                             n_polygons=args.n_polygons)
+
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(results.to_string(index=False, float_format='{:.3f}'.format))
+    with open(args.output, 'w') as f:
+        json.dump(json.loads(results.to_json(orient='records')), f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, pd.DataFrame(json.load(f)),
+                                  args.tolerance)
+        if len(regressions):
+            print(f'Stages slower than {args.tolerance}x the baseline:')
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print('No regressions against the baseline.')
@@ -0,0 +1,135 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+from typing import Sequence
+
+import gdal
+import numpy as np
+from equi7grid.equi7grid import Equi7Grid
+
+NODATA = -9999
+SCALE_FACTOR = 100
+TILE_SIZES = {'T1': 100000, 'T3': 300000, 'T6': 600000}  # [m]
+
+
+def tile_geotransform(tile_name: str, resolution: int) -> tuple:
+    '''GDAL geotransform and size in pixels of an Equi7 tile, e.g. "E048N015T1"'''
+    easting = int(tile_name[1:4]) * 100000
+    northing = int(tile_name[5:8]) * 100000
+    tile_size = TILE_SIZES[tile_name[8:]]
+    if easting % tile_size or northing % tile_size:
+        raise ValueError(f'{tile_name} is not an Equi7 tile, the lower left corner '
+                         f'must be a multiple of {tile_size // 1000} km')
+    return ((easting, resolution, 0, northing + tile_size, 0, -resolution),
+            tile_size // resolution)
+
+
+def sgrt_filename(time: datetime,
+                  pol: str,
+                  tile_name: str,
+                  resolution: int,
+                  relative_orbit: int = 95,
+                  orbit_direction: str = 'D') -> str:
+    '''SgrtFilename of a SIG0 file, e.g.
+    D20170111_051741--_SIG0-----_S1BIWGRDH1VVD_095_A0105_EU010M_E048N015T1.tif'''
+    return (f'D{time:%Y%m%d_%H%M%S}--_SIG0-----_S1AIWGRDH1{pol}{orbit_direction}'
+            f'_{relative_orbit:03}_A0105_EU{resolution:03}M_{tile_name}.tif')
+
+
+def synthetic_sig0(n_pixels: int, day_of_year: int,
+                   rng: np.random.Generator) -> np.ndarray:
+    '''int16 sigma0 [dB * 100] with a seasonal cycle, speckle and a nodata border'''
+    seasonal = -12 + 1.5 * np.sin(2 * np.pi * day_of_year / 365.25)
+    values = rng.normal(seasonal, 2.5, size=(n_pixels, n_pixels))
+    data = np.round(values * SCALE_FACTOR).astype(np.int16)
+    data[:, :n_pixels // 20] = NODATA  # e.g. the edge of the swath
+    return data
+
+
+def generate_archive(root_dir: str,
+                     tiles: Sequence[str] = ('E048N012T6', ),
+                     resolution: int = 500,
+                     n_dates: int = 30,
+                     pols: Sequence[str] = ('VV', 'VH'),
+                     start: datetime = datetime(2017, 1, 1),
+                     interval_days: int = 6,
+                     seed: int = 42) -> str:
+    '''Writes a local SIG0 archive in the layout of the shared datasets mount
+
+    `<root_dir>/EU<res>M/<tile>/sig0/<SgrtFilename>.tif`, tiled and LZW-compressed
+    int16 GeoTIFFs with nodata -9999 in the Equi7 EU projection.
+
+    Parameters
+    ----------
+
+    root_dir: str
+        Folder the archive is written to
+    tiles: Sequence[str]
+        Equi7 tile names matching `resolution` (T1 for 10 m, T6 for 500 m).
+        Default: ('E048N012T6', )
+    resolution: int
+        Pixel spacing [m]. Default: 500
+    n_dates: int
+        Number of acquisitions per tile and polarisation. Default: 30
+    pols: Sequence[str]
+        Polarisations. Default: ('VV', 'VH')
+    start: datetime
+        First acquisition. Default: 2017-01-01
+    interval_days: int
+        Revisit time [days]. Default: 6
+    seed: int
+        Seed of the random values. Default: 42
+
+    Returns
+    -------
+
+    str
+        Root path of the archive, to be passed as `DataCubeLoader(root_path=...)`
+    '''
+    rng = np.random.default_rng(seed)
+    archive_path = os.path.join(root_dir, f'EU{resolution:03}M')
+    projection = Equi7Grid(resolution).EU.core.projection.wkt
+    driver = gdal.GetDriverByName('GTiff')
+
+    for tile_name in tiles:
+        geotransform, n_pixels = tile_geotransform(tile_name, resolution)
+        folder = os.path.join(archive_path, tile_name, 'sig0')
+        os.makedirs(folder, exist_ok=True)
+
+        for i in range(n_dates):
+            time = start + timedelta(days=i * interval_days, hours=5, minutes=17)
+            for pol in pols:
+                path = os.path.join(
+                    folder, sgrt_filename(time, pol, tile_name, resolution))
+                dataset = driver.Create(path, n_pixels, n_pixels, 1,
+                                        gdal.GDT_Int16, [
+                                            'TILED=YES', 'BLOCKXSIZE=512',
+                                            'BLOCKYSIZE=512', 'COMPRESS=LZW'
+                                        ])
+                dataset.SetGeoTransform(geotransform)
+                dataset.SetProjection(projection)
+                band = dataset.GetRasterBand(1)
+                band.SetNoDataValue(NODATA)
+                band.WriteArray(
+                    synthetic_sig0(n_pixels,
+                                   time.timetuple().tm_yday, rng))
+                band.FlushCache()
+                dataset = None
+
+    return archive_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic Equi7/SGRT SIG0 archive')
+    parser.add_argument('root_dir')
+    parser.add_argument('--tiles', nargs='+', default=('E048N012T6', ))
+    parser.add_argument('--resolution', type=int, default=500)
+    parser.add_argument('--n-dates', type=int, default=30)
+    args = parser.parse_args()
+
+    print(
+        generate_archive(args.root_dir,
+                         tiles=args.tiles,
+                         resolution=args.resolution,
+                         n_dates=args.n_dates))
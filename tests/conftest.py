@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules import each other by name, e.g. `from testarea import TestArea`
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                    'MWRSExCode'))
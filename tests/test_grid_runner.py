@@ -0,0 +1,16 @@
+from grid_runner import Checkpoint
+
+
+def test_checkpoint_resumes_finished_cells(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    checkpoint = Checkpoint(path)
+    checkpoint.mark('10kmE480N280', 'done')
+    checkpoint.mark('10kmE480N281', 'failed', 'No data')
+    assert checkpoint.is_done('10kmE480N280')
+    assert not checkpoint.is_done('10kmE480N281')
+
+    with open(path, 'a') as f:
+        f.write('{"cell": "10kmE480N282", "sta')  # crashed while writing
+
+    resumed = Checkpoint(path)
+    assert resumed.finished == {'10kmE480N280'}
@@ -0,0 +1,54 @@
+import threading
+
+from instrumentation import Profiler
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler()
+    with profiler.stage('geotiff_read'):
+        profiler.count(files=1)
+    assert profiler.records == []
+
+
+def test_stages_nest_and_count_into_the_innermost_stage():
+    profiler = Profiler(enabled=True)
+    with profiler.stage('masked_array', testarea='a'):
+        profiler.count(pixels=5)
+        with profiler.stage('geotiff_read'):
+            profiler.count(files=2, bytes_read=100, pixels=50)
+
+    inner, outer = profiler.records
+    assert (inner['stage'], inner['parent']) == ('geotiff_read', 'masked_array')
+    assert (inner['files'], inner['bytes_read'], inner['pixels']) == (2, 100, 50)
+    assert (outer['stage'], outer['parent']) == ('masked_array', None)
+    assert (outer['files'], outer['pixels'], outer['testarea']) == (0, 5, 'a')
+    assert outer['seconds'] >= inner['seconds'] >= 0
+    assert not outer['failed']
+
+    summary = profiler.summary()
+    assert summary.loc['geotiff_read', 'calls'] == 1
+    assert summary.loc['geotiff_read', 'bytes_read'] == 100
+
+
+def test_failed_stages_and_threads():
+    profiler = Profiler(enabled=True)
+    try:
+        with profiler.stage('index_refresh'):
+            raise OSError
+    except OSError:
+        pass
+
+    def read():
+        with profiler.stage('geotiff_read'):
+            pass
+
+    with profiler.stage('masked_array'):
+        # a worker thread has its own stack, its stages have no parent
+        worker = threading.Thread(target=read)
+        worker.start()
+        worker.join()
+
+    failed, read, outer = profiler.records
+    assert failed['failed']
+    assert (read['stage'], read['parent']) == ('geotiff_read', None)
+    assert read['thread'] != outer['thread']
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from mapper import _nan_separated, tolerance_for_zoom
+from testarea import TestArea
+
+
+def test_tolerance_for_zoom():
+    assert tolerance_for_zoom(0) == pytest.approx(360 / 256)
+    assert tolerance_for_zoom(10) == pytest.approx(360 / 256 / 2**10)
+    # close zoom levels share a tolerance (and the cached geometry)
+    assert tolerance_for_zoom(10.7) == tolerance_for_zoom(10)
+    assert tolerance_for_zoom(10, pixels=2) == 2 * tolerance_for_zoom(10)
+
+
+def test_simplified_geometries_are_cached_per_tolerance():
+    n = 200
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    ring = np.column_stack([16 + 0.01 * np.cos(angles),
+                            48 + 0.01 * np.sin(angles)]).tolist()
+    testarea = TestArea('circle', 'spruce', {
+        'type': 'Polygon',
+        'coordinates': [ring + ring[:1]]
+    })
+
+    coarse = testarea.simplified(tolerance_for_zoom(8))
+    assert coarse is testarea.simplified(tolerance_for_zoom(8.5))
+    assert len(coarse.exterior.coords) < n
+    assert testarea.simplified(0) is testarea.shape
+
+
+def test_nan_separated():
+    parts = [np.zeros((3, 2)), np.ones((2, 2))]
+    stacked = _nan_separated(parts)
+    assert stacked.shape == (7, 2)
+    assert np.isnan(stacked[[3, 6]]).all()
+    np.testing.assert_array_equal(stacked[4:6], parts[1])
@@ -0,0 +1,69 @@
+import numpy as np
+
+from mask_cache import PixelMaskCache
+from testarea import TestArea
+
+
+def _testarea(name='area', offset=0.):
+    return TestArea(
+        name, 'spruce', {
+            'type':
+            'Polygon',
+            'coordinates': [[(16. + offset, 48.), (16.01 + offset, 48.),
+                             (16.01 + offset, 48.01), (16. + offset, 48.)]]
+        })
+
+
+def _window(x0=5., y0=95.):
+    return x0 + 10 * np.arange(4), y0 - 10 * np.arange(3)
+
+
+def test_key_depends_on_geometry_tiles_and_resolution():
+    key = PixelMaskCache.key(_testarea(), 'E048N012T1', 10)
+
+    assert key == PixelMaskCache.key(_testarea(name='renamed'), 'E048N012T1',
+                                     10)
+    assert len({
+        key,
+        PixelMaskCache.key(_testarea(offset=0.1), 'E048N012T1', 10),
+        PixelMaskCache.key(_testarea(), 'E049N012T1', 10),
+        PixelMaskCache.key(_testarea(), 'E048N012T1', 20)
+    }) == 4
+    many_tiles = '+'.join(f'E0{i}N012T1' for i in range(40, 50))
+    assert len(PixelMaskCache.key(_testarea(), many_tiles, 10)) < 120
+
+
+def test_masks_are_reused_and_evicted_least_recently_used():
+    cache = PixelMaskCache(cache_dir=None, max_entries=2)
+    calls = []
+
+    def create(name):
+        calls.append(name)
+        return np.ones((3, 4), dtype=bool)
+
+    areas = {name: _testarea(offset=i) for i, name in enumerate('abc')}
+    for name in 'abac':  # 'b' is the least recently used when 'c' is added
+        cache.get_or_create(areas[name], 'T1', 10, *_window(),
+                            lambda: create(name))
+    assert calls == ['a', 'b', 'c']
+
+    cache.get_or_create(areas['a'], 'T1', 10, *_window(), lambda: create('a'))
+    cache.get_or_create(areas['b'], 'T1', 10, *_window(), lambda: create('b'))
+    assert calls == ['a', 'b', 'c', 'b']
+
+
+def test_masks_are_rasterized_again_for_another_window(tmp_path):
+    mask = np.arange(12).reshape(3, 4) % 2 == 0
+    cache = PixelMaskCache(cache_dir=str(tmp_path))
+    cache.get_or_create(_testarea(), 'T1', 10, *_window(), lambda: mask)
+
+    # a new instance reads the mask from disk
+    reloaded = PixelMaskCache(cache_dir=str(tmp_path)).get_or_create(
+        _testarea(), 'T1', 10, *_window(), lambda: ~mask)
+    np.testing.assert_array_equal(reloaded, mask)
+    assert not reloaded.flags.writeable
+    assert not [path for path in tmp_path.iterdir() if path.suffix == '.tmp']
+
+    shifted = cache.get_or_create(_testarea(), 'T1', 10, *_window(x0=15.),
+                                  lambda: ~mask)
+    np.testing.assert_array_equal(shifted, ~mask)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from multi_product import nearest_join, windowed_join
+
+
+def _series(days, values):
+    times = pd.Timestamp('2018-01-01') + pd.to_timedelta(days, unit='D')
+    return xr.DataArray(np.asarray(values, dtype=float)[:, None],
+                        dims=('time', 'x'),
+                        coords={
+                            'time': times.values,
+                            'x': [0.]
+                        })
+
+
+def _reference(*days):
+    return (pd.Timestamp('2018-01-01') +
+            pd.to_timedelta(list(days), unit='D')).values
+
+
+def test_windowed_join_includes_both_window_edges():
+    data = _series([0, 8, 16], [1., 2., 4.])
+    joined = windowed_join(_reference(8), data, '16D')
+    np.testing.assert_allclose(joined.values[:, 0], [7 / 3])
+
+
+def test_windowed_join_excludes_values_beyond_half_window():
+    data = _series([0, 8, 16], [1., 2., 4.])
+    joined = windowed_join(_reference(8), data, '15D')
+    np.testing.assert_allclose(joined.values[:, 0], [2.])
+
+
+def test_windowed_join_ignores_nan_and_empty_windows():
+    data = _series([0, 8, 16], [1., np.nan, 4.])
+    joined = windowed_join(_reference(8, 40), data, '16D')
+    np.testing.assert_allclose(joined.values[0, 0], 2.5)
+    assert np.isnan(joined.values[1, 0])
+    np.testing.assert_array_equal(joined.time.values, _reference(8, 40))
+
+
+def test_nearest_join_respects_tolerance():
+    data = _series([0, 10], [1., 2.])
+    joined = nearest_join(_reference(3, 8, 20), data, '3D')
+    np.testing.assert_allclose(joined.values[:, 0], [1., 2., np.nan])
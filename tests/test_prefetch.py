@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+import pytest
+
+from prefetch import PrefetchReader
+
+
+def test_results_are_yielded_in_input_order():
+
+    def read(item):
+        time.sleep(0.01 * (5 - item))  # later items finish first
+        return item * 10
+
+    reader = PrefetchReader(read, queue_depth=4, n_workers=4)
+    assert list(reader.iter(range(5))) == [(i, i * 10) for i in range(5)]
+
+
+def test_early_stop_and_read_errors():
+    reader = PrefetchReader(lambda item: item, queue_depth=2)
+    for item, _ in reader.iter(range(100)):
+        if item == 3:
+            break
+
+    def read(item):
+        if item == 2:
+            raise OSError('broken file')
+        return item
+
+    with pytest.raises(OSError):
+        list(PrefetchReader(read).iter(range(5)))
+
+
+def test_memory_cap_limits_the_reads_ahead():
+    reader = PrefetchReader(lambda item: np.zeros(100, dtype=np.uint8),
+                            queue_depth=8,
+                            max_bytes=250)
+    assert reader._capacity() == 8  # no estimate yet
+    list(reader.iter(range(3)))
+    assert reader._capacity() == 2
+
+    reader.max_bytes = 10  # a window larger than the cap is still read
+    assert reader._capacity() == 1
+
+    with pytest.raises(ValueError):
+        PrefetchReader(lambda item: item, queue_depth=0)
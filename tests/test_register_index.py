@@ -0,0 +1,53 @@
+import os
+from datetime import datetime
+
+from register_index import FileRegisterIndex
+
+TILE = 'E048N012T1'
+
+
+def _sgrt_name(time: str, pol: str) -> str:
+    return (f'D{time}--_SIG0-----_S1BIWGRDH1{pol}D_095_A0105_EU010M_'
+            f'{TILE}.tif')
+
+
+def _touch(folder, name):
+    os.makedirs(folder, exist_ok=True)
+    open(os.path.join(folder, name), 'w').close()
+    return os.path.join(folder, name)
+
+
+def test_refresh_and_query(tmp_path):
+    folder = tmp_path / 'EU010M' / TILE / 'SIG0'
+    vv_jan = _touch(folder, _sgrt_name('20170111_051741', 'VV'))
+    vh_jan = _touch(folder, _sgrt_name('20170111_051741', 'VH'))
+    vv_feb = _touch(folder, _sgrt_name('20170204_051741', 'VV'))
+    _touch(folder, 'Q' + _sgrt_name('20170111_051741', 'VV')[1:])  # quicklook
+
+    index = FileRegisterIndex(str(tmp_path / 'EU010M'), ['tile', 'quantity'],
+                              index_path=str(tmp_path / 'index.sqlite'))
+    assert index.refresh() == {'scanned': 1, 'unchanged': 0, 'removed': 0}
+    assert index.file_register == sorted([vv_jan, vh_jan, vv_feb])
+
+    assert index.query(pol='VV') == sorted([vv_jan, vv_feb])
+    assert index.query(tile_name=TILE, var_name='SIG0',
+                       pol='VH') == [vh_jan]
+    assert index.query(start=datetime(2017, 2, 1)) == [vv_feb]
+    assert index.query(end=datetime(2017, 2, 1)) == sorted([vv_jan, vh_jan])
+    assert index.query(tile_name='E049N012T1') == []
+
+
+def test_refresh_only_rescans_changed_folders(tmp_path):
+    root = tmp_path / 'EU010M'
+    _touch(root / TILE / 'SIG0', _sgrt_name('20170111_051741', 'VV'))
+    _touch(root / TILE / 'TMENPLIA', _sgrt_name('20170111_051741', 'VV'))
+
+    index = FileRegisterIndex(str(root), ['tile', 'quantity'],
+                              index_path=str(tmp_path / 'index.sqlite'))
+    assert index.refresh()['scanned'] == 2
+    assert index.refresh() == {'scanned': 0, 'unchanged': 2, 'removed': 0}
+
+    added = _touch(root / TILE / 'SIG0', _sgrt_name('20170204_051741', 'VV'))
+    os.utime(root / TILE / 'SIG0', ns=(0, 1))  # also on coarse mtime resolutions
+    assert index.refresh() == {'scanned': 1, 'unchanged': 1, 'removed': 0}
+    assert added in index.file_register
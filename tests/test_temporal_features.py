@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from temporal_features import DAYS_PER_YEAR, design_matrix, fit_harmonics
+
+
+def _annual_cycle(times, intercept, trend, amplitude, peak_day):
+    design, names = design_matrix(times, n_harmonics=1, trend=True)
+    years = design[:, names.index('trend')]
+    angle = 2 * np.pi * (years * DAYS_PER_YEAR - peak_day) / DAYS_PER_YEAR
+    return design, names, intercept + trend * years + amplitude * np.cos(angle)
+
+
+def test_fit_harmonics_recovers_amplitude_and_phase():
+    times = pd.date_range('2017-01-01', '2019-12-31', freq='6D').values
+    design, names, values = _annual_cycle(times, -12., 0.3, 2.5, 200.)
+    values = np.vstack([values, values])
+    values[1, ::3] = np.nan  # gaps are ignored
+
+    coefficients, rmse = fit_harmonics(values, design)
+    parameters = dict(zip(names, coefficients.T))
+
+    np.testing.assert_allclose(parameters['intercept'], -12., atol=1e-8)
+    np.testing.assert_allclose(parameters['trend'], 0.3, atol=1e-8)
+    np.testing.assert_allclose(
+        np.hypot(parameters['cos_1'], parameters['sin_1']), 2.5, atol=1e-8)
+    phase = (np.arctan2(parameters['sin_1'], parameters['cos_1']) %
+             (2 * np.pi)) / (2 * np.pi) * DAYS_PER_YEAR
+    np.testing.assert_allclose(phase, 200., atol=1e-6)
+    np.testing.assert_allclose(rmse, 0., atol=1e-8)
+
+
+def test_fit_harmonics_marks_underdetermined_pixels():
+    times = pd.date_range('2017-01-01', '2017-12-31', freq='6D').values
+    design, _, values = _annual_cycle(times, -10., 0., 1., 100.)
+    sparse = np.full_like(values, np.nan)
+    sparse[:3] = values[:3]  # fewer values than parameters + 1
+
+    coefficients, rmse = fit_harmonics(
+        np.vstack([values, sparse, np.full_like(values, np.nan)]), design)
+    assert np.isfinite(coefficients[0]).all()
+    assert np.isnan(coefficients[1:]).all() and np.isnan(rmse[1:]).all()
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from testarea import TestArea
+from timeseries_by_geom import (PERIOD_FREQUENCIES, DataCubeLoader,
+                                _block_slices, _cluster_windows, _cut_area,
+                                _grid_attrs, _period_label, sparse_to_dense)
+
+
+def _sparse(values, x_values, y_values, x_idx, y_idx, attrs=None):
+    time = pd.date_range('2017-01-01', periods=values.shape[-1], freq='6D')
+    data = xr.DataArray(values[x_idx, y_idx],
+                        dims=('pixel', 'time'),
+                        coords={
+                            'x': ('pixel', x_values[x_idx]),
+                            'y': ('pixel', y_values[y_idx]),
+                            'time': time
+                        },
+                        attrs=attrs or {})
+    return xr.Dataset({'data': data},
+                      attrs=_grid_attrs(x_values, y_values, 10))
+
+
+def test_sparse_to_dense_round_trip():
+    x_values = 4800000. + 10 * np.arange(4) + 5
+    y_values = 1300000. - 10 * np.arange(3) - 5
+    values = np.random.default_rng(0).normal(-12, 2, (4, 3, 5))
+    x_idx, y_idx = np.array([0, 1, 3]), np.array([2, 0, 1])
+
+    dense = sparse_to_dense(
+        _sparse(values, x_values, y_values, x_idx, y_idx))
+
+    assert dense['data'].dims == ('x', 'y', 'time')
+    np.testing.assert_array_equal(dense.x.values, x_values)
+    np.testing.assert_array_equal(dense.y.values, y_values)
+    expected = np.full_like(values, np.nan)
+    expected[x_idx, y_idx] = values[x_idx, y_idx]
+    np.testing.assert_array_equal(dense['data'].values, expected)
+    assert dense['coords'].shape == (12, 2)
+
+
+def test_sparse_to_dense_fills_raw_data_with_nodata():
+    x_values = 4800000. + 10 * np.arange(2) + 5
+    y_values = 1300000. - 10 * np.arange(2) - 5
+    values = np.arange(2 * 2 * 3, dtype=np.int16).reshape(2, 2, 3)
+
+    dense = sparse_to_dense(
+        _sparse(values, x_values, y_values, np.array([1]), np.array([0]),
+                {'_FillValue': -9999}))
+
+    assert dense['data'].dtype == np.int16
+    np.testing.assert_array_equal(dense['data'].values[1, 0], values[1, 0])
+    assert (dense['data'].values[0] == -9999).all()
+
+
+class _ProjectedLoader:
+    '''Loader stand-in whose "projection" is the identity'''
+    resolution = 10
+    storage = 'decoded'
+    apply_pixel_mask = DataCubeLoader.apply_pixel_mask
+
+    def project(self, coords):
+        return np.asarray(coords, dtype=float)
+
+    def pixel_mask(self, testarea, tiles, x_values, y_values):
+        return testarea.contains(*np.meshgrid(x_values, y_values))
+
+
+def test_cluster_windows_joins_neighbours_up_to_the_cap():
+    bounds = np.array([[0., 0., 20., 20.], [30., 0., 50., 20.],
+                       [1000., 1000., 1020., 1020.]])
+    assert _cluster_windows(bounds, 10, 100) == [[0, 1], [2]]
+    assert _cluster_windows(bounds, 10, 10) == [[0], [1], [2]]
+
+
+def test_cluster_windows_keeps_large_areas_apart():
+    bounds = np.array([[0., 0., 20., 20.], [0., 0., 200., 200.]])
+    assert _cluster_windows(bounds, 10, 100) == [[0], [1]]
+
+
+def test_cut_area():
+    x_values = 5. + 10 * np.arange(30)
+    y_values = 295. - 10 * np.arange(30)
+    dataset = xr.Dataset({
+        'data': (('time', 'y', 'x'), np.ones((2, 30, 30)))
+    },
+                         coords={
+                             'time': pd.date_range('2017-01-01', periods=2),
+                             'y': y_values,
+                             'x': x_values
+                         })
+    triangle = TestArea('area', 'spruce', {
+        'type': 'Polygon',
+        'coordinates': [[(100, 200), (130, 200), (100, 230), (100, 200)]]
+    })
+
+    window = _cut_area(dataset, triangle, _ProjectedLoader(), ['T1'])
+    np.testing.assert_array_equal(window.x.values, [95, 105, 115, 125, 135])
+    np.testing.assert_array_equal(window.y.values, [235, 225, 215, 205, 195])
+    assert window.attrs['tiles'] == 'T1'
+    assert (window['data'].values == 1).all()
+
+    masked = _cut_area(dataset, triangle, _ProjectedLoader(), ['T1'],
+                       apply_mask=True)['data'].sel(time='2017-01-01')
+    assert masked.sel(x=105, y=205).item() == 1
+    assert np.isnan(masked.sel(x=125, y=225).item())
+
+
+def test_period_labels():
+    times = pd.DatetimeIndex(['2017-12-31', '2018-01-01', '2018-03-05'])
+
+    def labels(period):
+        return [
+            _period_label(time_period, period) for time_period in times.to_period(
+                PERIOD_FREQUENCIES[period])
+        ]
+
+    assert labels('day') == ['2017-12-31', '2018-01-01', '2018-03-05']
+    assert labels('week') == ['2017-W52', '2018-W01', '2018-W10']
+    assert labels('month') == ['2017-12', '2018-01', '2018-03']
+    # December counts to the winter of the following year
+    assert labels('season') == ['2018-DJF', '2018-DJF', '2018-MAM']
+
+
+def test_block_slices_follow_the_file_blocks():
+    assert _block_slices(10, 0, 4) == [slice(0, 4), slice(4, 8), slice(8, 10)]
+    # the window starts 3 pixels into the second block of the file
+    assert _block_slices(10, 7, 4) == [slice(0, 1), slice(1, 5), slice(5, 9),
+                                       slice(9, 10)]
+    assert _block_slices(3, 1, 4) == [slice(0, 3)]
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from timeseries_store import _align_to_store
+
+TIME = pd.date_range('2017-01-01', periods=2, freq='6D')
+
+
+def _sparse(x_values, y_values, values):
+    return xr.Dataset({
+        'data':
+        xr.DataArray(values,
+                     dims=('pixel', 'time'),
+                     coords={
+                         'x': ('pixel', np.asarray(x_values, dtype=float)),
+                         'y': ('pixel', np.asarray(y_values, dtype=float)),
+                         'time': TIME
+                     })
+    })
+
+
+def _dense(x_values, y_values):
+    values = np.ones((len(x_values), len(y_values), len(TIME)))
+    return xr.Dataset({
+        'data':
+        xr.DataArray(values,
+                     dims=('x', 'y', 'time'),
+                     coords={
+                         'x': np.asarray(x_values, dtype=float),
+                         'y': np.asarray(y_values, dtype=float),
+                         'time': TIME
+                     })
+    })
+
+
+def test_sparse_data_keeps_the_stored_pixel_index():
+    stored = _sparse([5, 15, 25], [95, 95, 85], np.zeros((3, 2)))
+    new = _sparse([25, 5, 35], [85, 95, 75], [[1., 2.], [3., 4.], [5., 6.]])
+
+    with pytest.warns(UserWarning, match='1 pixels'):
+        aligned = _align_to_store(new, stored, 'area')
+
+    np.testing.assert_array_equal(aligned.x.values, stored.x.values)
+    np.testing.assert_array_equal(aligned.y.values, stored.y.values)
+    np.testing.assert_array_equal(aligned['data'].values,
+                                  [[3., 4.], [np.nan, np.nan], [1., 2.]])
+
+
+def test_dense_data_is_reindexed_onto_the_stored_grid():
+    stored = _dense([5, 15, 25], [95, 85])
+
+    aligned = _align_to_store(_dense([15, 25], [95, 85]), stored, 'area')
+
+    np.testing.assert_array_equal(aligned.x.values, stored.x.values)
+    assert np.isnan(aligned['data'].values[0]).all()
+    assert (aligned['data'].values[1:] == 1).all()
+    with pytest.raises(ValueError, match='not part of the grid'):
+        _align_to_store(_dense([10, 20], [95, 85]), stored, 'area')
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pandas as pd
+
+from testarea import TestArea
+from timeseries_by_geom import TemporalWindow
+from window_cache import WindowStackCache
+
+
+def _testarea(size=0.01):
+    return TestArea(
+        'area', 'spruce', {
+            'type':
+            'Polygon',
+            'coordinates': [[(16.0, 48.0), (16.0 + size, 48.0),
+                             (16.0 + size, 48.0 + size), (16.0, 48.0 + size),
+                             (16.0, 48.0)]]
+        })
+
+
+def _inventory(tiles=('E048N012T1', ), pols=('VV', )):
+    rows = [{
+        'time': datetime(2017, 1, day),
+        'tile': tile,
+        'var_name': 'SIG0',
+        'pol': pol
+    } for day in (1, 7) for tile in tiles for pol in pols]
+    return pd.DataFrame(rows)
+
+
+def test_key_ignores_the_inventory_order():
+    inventory = _inventory(tiles=('E048N012T1', 'E049N012T1'))
+    key = WindowStackCache.key(_testarea(), inventory)
+
+    assert key == WindowStackCache.key(_testarea(), inventory[::-1])
+    assert key != WindowStackCache.key(
+        _testarea(), inventory[inventory['tile'] == 'E048N012T1'])
+
+
+def test_key_changes_with_every_part():
+    inventory = _inventory()
+    key = WindowStackCache.key(_testarea(), inventory)
+    window = TemporalWindow(datetime(2017, 1, 1), datetime(2017, 2, 1))
+
+    keys = {
+        key,
+        WindowStackCache.key(_testarea(size=0.02), inventory),
+        WindowStackCache.key(_testarea(), _inventory(tiles=('E049N012T1', ))),
+        WindowStackCache.key(_testarea(), _inventory(pols=('VH', ))),
+        WindowStackCache.key(_testarea(), inventory, window),
+        WindowStackCache.key(_testarea(), inventory, storage='raw')
+    }
+    assert len(keys) == 6
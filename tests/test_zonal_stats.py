@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from zonal_stats import _check_statistics, _reduce
+
+
+def test_reduce_in_db():
+    values = np.array([-14., -12., -10., -8.])
+
+    result = _reduce(values, ('mean', 'median', 'std', 'min', 'max', 'p25',
+                              'count'), linear=False)
+
+    assert result['mean'] == pytest.approx(-11.)
+    assert result['median'] == pytest.approx(-11.)
+    assert result['std'] == pytest.approx(values.std())
+    assert (result['min'], result['max']) == (-14., -8.)
+    assert result['p25'] == pytest.approx(np.percentile(values, 25))
+    assert result['count'] == 4
+
+
+def test_reduce_in_linear_power():
+    values = np.array([-20., -10.])
+    power = 10**(values / 10)
+
+    result = _reduce(values, ('mean', 'std', 'max'), linear=True)
+
+    assert set(result) == {'mean', 'std_linear', 'max'}
+    assert result['mean'] == pytest.approx(10 * np.log10(power.mean()))
+    assert result['std_linear'] == pytest.approx(power.std())
+    assert result['max'] == pytest.approx(-10.)
+
+
+def test_reduce_without_values():
+    result = _reduce(np.array([]), ('mean', 'p90', 'count'), linear=False)
+
+    assert np.isnan(result['mean']) and np.isnan(result['p90'])
+    assert result['count'] == 0
+
+
+def test_check_statistics():
+    _check_statistics(('mean', 'median', 'p10', 'p2.5', 'count'))
+    with pytest.raises(ValueError, match='p100'):
+        _check_statistics(('mean', 'p100', 'variance'))